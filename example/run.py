@@ -83,4 +83,5 @@ conf.action("samsung_tv_volume_down", emit("multi_amp_voldown"))
 
 # finally, start the ir control program with this configuration, this also
 # handles the argument parsing etc.
-start(conf)
+if __name__ == "__main__":
+    start(conf)
@@ -54,8 +54,45 @@ decode_results results_;
 // Settings
 uint16_t serial_receive_timeout_ = 1000;
 
+// The baudrate at boot, the host can negotiate a higher one.
+#define DEFAULT_BAUDRATE 9600
+// After switching, the host must send a command within this time (ms).
+#define BAUDRATE_VERIFY_TIMEOUT 1000
+
+uint32_t baudrate_ = DEFAULT_BAUDRATE;
+uint32_t baudrate_previous_ = DEFAULT_BAUDRATE;
+uint32_t baudrate_verify_deadline_ = 0;  // 0 means no switch pending.
+
+const uint32_t supported_baudrates_[] = {9600, 19200, 38400, 57600, 115200,
+                                         250000, 500000, 1000000};
+
+// The protocol in use and the buffer for incoming version 2 frames, these
+// hold the COBS encoded payload and CRC.
+uint8_t protocol_ = PROTOCOL_V1;
+uint8_t frame_[MAX_PAYLOAD + 2 + 2];
+uint8_t frame_length_ = 0;
+bool frame_overflow_ = false;
+
+// Buffer for raw durations in microseconds that are to be sent, the host
+// checks the same limit (MAX_DURATIONS in raw.py).
+#define RAW_MAX_DURATIONS 256
+unsigned int raw_buffer_[RAW_MAX_DURATIONS];
+uint16_t raw_length_ = 0;
+uint8_t raw_khz_ = 38;
+uint8_t raw_sequence_ = 0;
+bool raw_valid_ = false;
+uint8_t raw_pending_ = 0;  // first byte of a duration split over chunks.
+
+// Gaps in ms between the repeats of a held key, see emitIRRepeat.
+#define NEC_FIRST_REPEAT_GAP 40
+#define NEC_REPEAT_GAP 97
+#define REPEAT_GAP 40
+// At most this many repeats, about a second, such that the serial port is
+// not left unread for too long.
+#define MAX_REPEATS 9
+
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(DEFAULT_BAUDRATE);
   irrecv.blink13(1);  // enable led blink on receive.
   irrecv.enableIRIn();  // Start the receiver.
   Serial.setTimeout(serial_receive_timeout_);  // Set the readBytes timeout.
@@ -64,6 +101,121 @@ void setup() {
 }
 
 
+// CRC-16/CCITT-FALSE, the same as computed by the host.
+uint16_t crc16(const uint8_t* data, uint8_t length) {
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t j = 0; j < 8; j++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+    }
+  }
+  return crc;
+}
+
+// Appends the CRC, COBS encodes the payload and writes it with delimiter.
+// payload must have room for the two CRC bytes.
+void sendFrame(uint8_t* payload, uint8_t length) {
+  uint16_t crc = crc16(payload, length);
+  payload[length++] = crc & 0xFF;
+  payload[length++] = crc >> 8;
+
+  uint8_t out[MAX_PAYLOAD + 2 + 2];
+  uint8_t code_index = 0;
+  uint8_t out_index = 1;
+  uint8_t code = 1;
+  for (uint8_t i = 0; i < length; i++) {
+    if (payload[i] == 0) {
+      out[code_index] = code;
+      code_index = out_index++;
+      code = 1;
+    } else {
+      out[out_index++] = payload[i];
+      code++;
+    }
+  }
+  out[code_index] = code;
+  out[out_index++] = 0;
+  Serial.write(out, out_index);
+}
+
+// Send a message to the host, in the protocol that is currently in use.
+void sendMessage(const msg_t* msg) {
+  if (protocol_ == PROTOCOL_V1) {
+    Serial.write(reinterpret_cast<const uint8_t*>(msg), sizeof(msg_t));
+    return;
+  }
+
+  // Version 2; the type followed by the body. IR specifications are sent as
+  // is, otherwise trailing zeros are omitted as the host restores these.
+  uint8_t payload[MAX_PAYLOAD + 2];
+  uint8_t length = sizeof(msg->raw);
+  payload[0] = msg->type;
+  memcpy(payload + 1, msg->raw, length);
+  if (msg->type == action_IR_send) {
+    length = sizeof(msg_ir_t);
+  } else if (msg->type == action_IR_received) {
+    length = sizeof(msg_ir_received_t);
+  } else {
+    while (length && (msg->raw[length - 1] == 0)) {
+      length--;
+    }
+  }
+  sendFrame(payload, length + 1);
+}
+
+// Decodes the frame in frame_ and processes the commands in it.
+void processFrame() {
+  // COBS decode in place, the decoded data is never longer than the input.
+  uint8_t length = 0;
+  uint8_t i = 0;
+  while (i < frame_length_) {
+    uint8_t code = frame_[i];
+    if ((code == 0) || (i + code > frame_length_)) {
+      return;  // malformed.
+    }
+    for (uint8_t j = 1; j < code; j++) {
+      frame_[length++] = frame_[i + j];
+    }
+    i += code;
+    if ((code < 0xFF) && (i < frame_length_)) {
+      frame_[length++] = 0;
+    }
+  }
+
+  if (length < 3) {
+    return;
+  }
+  length -= 2;
+  uint16_t crc = frame_[length] | ((uint16_t)frame_[length + 1] << 8);
+  if (crc16(frame_, length) != crc) {
+    DBGln("CRC mismatch.");
+    return;
+  }
+
+  // A valid frame also confirms the baudrate.
+  baudrate_verify_deadline_ = 0;
+
+  char buffer[sizeof(msg_t)] = {0};
+  msg_t* msg = reinterpret_cast<msg_t*>(buffer);
+  msg->type = static_cast<msg_type>(frame_[0]);
+  if (msg->type == action_IR_send) {
+    // Several IR specifications may be batched in one frame.
+    for (uint8_t offset = 1; offset + sizeof(msg_ir_t) <= length;
+         offset += sizeof(msg_ir_t)) {
+      memcpy(&(msg->ir_specification), frame_ + offset, sizeof(msg_ir_t));
+      processCommand(msg);
+    }
+    return;
+  }
+  uint8_t body_length = length - 1;
+  if (body_length > sizeof(msg->raw)) {
+    body_length = sizeof(msg->raw);
+  }
+  memcpy(msg->raw, frame_ + 1, body_length);
+  processCommand(msg);
+}
+
 // Handle incomming commands from the serial port.
 void processCommand(const msg_t* msg) {
   switch (msg->type) {
@@ -84,7 +236,7 @@ void processCommand(const msg_t* msg) {
         response->type = get_config;
 
         response->config.serial_receive_timeout = serial_receive_timeout_;
-        Serial.write(buffer, sizeof(msg_t));
+        sendMessage(response);
       }
       break;
 
@@ -96,6 +248,128 @@ void processCommand(const msg_t* msg) {
       }
       break;
 
+    case action_IR_repeat: {
+        DBGln("Got action_IR_repeat.");
+        emitIRRepeat(msg->ir_repeat.type,
+                     msg->ir_repeat.bits,
+                     msg->ir_repeat.value,
+                     msg->ir_repeat.count);
+      }
+      break;
+
+
+    case set_baudrate: {
+        DBGln("Got set_baudrate.");
+        uint32_t requested = msg->baudrate.baudrate;
+        bool supported = false;
+        for (uint8_t i = 0; i < sizeof(supported_baudrates_) /
+                                sizeof(supported_baudrates_[0]); i++) {
+          supported |= (supported_baudrates_[i] == requested);
+        }
+
+        // Acknowledge at the current speed, with the new baudrate if it is
+        // supported, otherwise with the current one.
+        char buffer[sizeof(msg_t)] = {0};
+        msg_t* response = reinterpret_cast<msg_t*>(buffer);
+        response->type = set_baudrate;
+        response->baudrate.baudrate = supported ? requested : baudrate_;
+        sendMessage(response);
+        if (!supported) {
+          break;
+        }
+
+        // Switch once the acknowledgement is sent, revert if the host does
+        // not send a command at the new speed in time.
+        Serial.flush();
+        Serial.end();
+        baudrate_previous_ = baudrate_;
+        baudrate_ = requested;
+        Serial.begin(baudrate_);
+        Serial.setTimeout(serial_receive_timeout_);
+        baudrate_verify_deadline_ = millis() + BAUDRATE_VERIFY_TIMEOUT;
+        if (baudrate_verify_deadline_ == 0) {
+          baudrate_verify_deadline_ = 1;
+        }
+      }
+      break;
+
+    case set_protocol: {
+        DBGln("Got set_protocol.");
+        uint8_t requested = msg->protocol.version;
+        bool supported = (requested == PROTOCOL_V1) ||
+                         (requested == PROTOCOL_V2);
+
+        // Acknowledge in the current protocol, then switch.
+        char buffer[sizeof(msg_t)] = {0};
+        msg_t* response = reinterpret_cast<msg_t*>(buffer);
+        response->type = set_protocol;
+        response->protocol.version = supported ? requested : protocol_;
+        sendMessage(response);
+        protocol_ = response->protocol.version;
+        frame_length_ = 0;
+      }
+      break;
+
+    case action_raw_send: {
+        DBGln("Got action_raw_send.");
+        const msg_raw_chunk_t* chunk = &(msg->raw_chunk);
+        uint8_t flags = 0;
+        if (chunk->flags & RAW_FIRST) {
+          raw_valid_ = true;
+          raw_length_ = 0;
+          raw_pending_ = 0;
+        } else if (!raw_valid_ ||
+                   (chunk->sequence != (uint8_t)(raw_sequence_ + 1))) {
+          raw_valid_ = false;
+          flags = RAW_ERROR;
+        }
+        raw_sequence_ = chunk->sequence;
+
+        // Decode the durations, the first byte of a code is the frequency.
+        uint8_t i = 0;
+        if (raw_valid_ && (chunk->flags & RAW_FIRST) && chunk->length) {
+          raw_khz_ = chunk->data[0];
+          i = 1;
+        }
+        for (; raw_valid_ && (i < chunk->length) &&
+               (i < RAW_CHUNK_SIZE); i++) {
+          uint8_t b = chunk->data[i];
+          uint16_t ticks;
+          if (raw_pending_) {
+            ticks = ((uint16_t)(raw_pending_ & 0x7F) << 8) | b;
+            raw_pending_ = 0;
+          } else if (b & 0x80) {
+            raw_pending_ = b;
+            continue;
+          } else {
+            ticks = b;
+          }
+          if (raw_length_ >= RAW_MAX_DURATIONS) {
+            raw_valid_ = false;
+            flags = RAW_ERROR;
+            break;
+          }
+          if (ticks > RAW_MAX_TICKS) {
+            ticks = RAW_MAX_TICKS;  // would wrap around.
+          }
+          raw_buffer_[raw_length_++] = ticks * RAW_TICK_US;
+        }
+
+        if (raw_valid_ && (chunk->flags & RAW_LAST)) {
+          irsend.sendRaw(raw_buffer_, raw_length_, raw_khz_);
+          irrecv.enableIRIn();  // Re-enable the IR receiver.
+          raw_valid_ = false;
+        }
+
+        // Acknowledge the chunk, this provides the flow control.
+        char buffer[sizeof(msg_t)] = {0};
+        msg_t* response = reinterpret_cast<msg_t*>(buffer);
+        response->type = raw_ack;
+        response->raw_chunk.sequence = chunk->sequence;
+        response->raw_chunk.flags = flags;
+        sendMessage(response);
+      }
+      break;
 
     case get_status: {
         DBGln("Got get_status.");
@@ -103,7 +377,7 @@ void processCommand(const msg_t* msg) {
         msg_t* response = reinterpret_cast<msg_t*>(buffer);
         response->type = get_status;
         response->status.uptime = millis();
-        Serial.write(buffer, sizeof(msg_t));
+        sendMessage(response);
       }
       break;
 
@@ -154,6 +428,33 @@ void emitIRCode(uint8_t type, uint8_t nbits, uint32_t data) {
   irrecv.enableIRIn();  // Re-enable the IR receiver.
 }
 
+// Sends an IR code followed by count repeats, as if the key is held. NEC
+// has a short repeat frame every 108 ms, other protocols repeat the code.
+void emitIRRepeat(uint8_t type, uint8_t nbits, uint32_t data, uint8_t count) {
+  emitIRCode(type, nbits, data);
+  if (count > MAX_REPEATS) {
+    count = MAX_REPEATS;
+  }
+  for (uint8_t i = 0; i < count; i++) {
+    #if SEND_NEC
+      if (type == NEC) {
+        // The code takes 67.5 ms and a repeat frame 11.25 ms of the period.
+        // IRremote 2.0.1 does not send repeat frames, write it here.
+        delay(i ? NEC_REPEAT_GAP : NEC_FIRST_REPEAT_GAP);
+        irsend.enableIROut(38);
+        irsend.mark(9000);
+        irsend.space(2250);
+        irsend.mark(560);
+        irsend.space(0);
+        continue;
+      }
+    #endif
+    delay(REPEAT_GAP);
+    emitIRCode(type, nbits, data);
+  }
+  irrecv.enableIRIn();  // Re-enable the IR receiver.
+}
+
 // Send a received IR code over the serial port.
 void sendReceivedIR(decode_results *results) {
   char buffer[sizeof(msg_t)] = {0};
@@ -167,8 +468,42 @@ void sendReceivedIR(decode_results *results) {
   response->ir_specification.type = results->decode_type;
   response->ir_specification.bits = results->bits;
   response->ir_specification.value = results->value;
+  response->ir_received.timestamp = millis();
+
+  sendMessage(response);
+}
+
+// Send the raw durations of a received code in chunks, used for codes that
+// could not be decoded.
+void sendReceivedRaw(decode_results *results) {
+  char buffer[sizeof(msg_t)] = {0};
+  msg_t* response = reinterpret_cast<msg_t*>(buffer);
+  response->type = action_raw_received;
+  msg_raw_chunk_t* chunk = &(response->raw_chunk);
+  chunk->flags = RAW_FIRST;
+  chunk->sequence = 0;
 
-  Serial.write(buffer, sizeof(msg_t));
+  // rawbuf[0] is the gap before the code, it is not sent. The durations are
+  // in ticks of USECPERTICK, which matches RAW_TICK_US.
+  for (uint16_t i = 1; i < results->rawlen; i++) {
+    uint16_t ticks = results->rawbuf[i];
+    uint8_t bytes = (ticks < 0x80) ? 1 : 2;
+    if (chunk->length + bytes > RAW_CHUNK_SIZE) {
+      sendMessage(response);
+      chunk->sequence++;
+      chunk->flags = 0;
+      chunk->length = 0;
+      memset(chunk->data, 0, RAW_CHUNK_SIZE);
+    }
+    if (bytes == 1) {
+      chunk->data[chunk->length++] = ticks;
+    } else {
+      chunk->data[chunk->length++] = 0x80 | ((ticks >> 8) & 0x7F);
+      chunk->data[chunk->length++] = ticks & 0xFF;
+    }
+  }
+  chunk->flags |= RAW_LAST;
+  sendMessage(response);
 }
 
 // loop; continuously read IR commands and read serial commands.
@@ -176,15 +511,45 @@ void loop() {
   // Check if we have decoded an IR code.
   if (irrecv.decode(&results_)) {
     sendReceivedIR(&results_);  // Sent it over the Serial port.
+    if (results_.decode_type == UNKNOWN) {
+      sendReceivedRaw(&results_);  // Let the host have a go at decoding it.
+    }
     irrecv.resume();  // Receive the next value.
   }
 
   // Check if we should read the serial port for commands.
-  if (Serial.available()) {
+  if (protocol_ == PROTOCOL_V2) {
+    while (Serial.available()) {
+      uint8_t c = Serial.read();
+      if (c == 0) {
+        if (!frame_overflow_) {
+          processFrame();
+        }
+        frame_length_ = 0;
+        frame_overflow_ = false;
+      } else if (frame_length_ < sizeof(frame_)) {
+        frame_[frame_length_++] = c;
+      } else {
+        frame_overflow_ = true;  // discard until the next delimiter.
+      }
+    }
+  } else if (Serial.available()) {
     char buffer[sizeof(msg_t)] = {0};
     if (Serial.readBytes(buffer, sizeof(msg_t)) == sizeof(msg_t)) {
-      // we have a command, process it.
+      // we have a command, process it. This also confirms the baudrate.
+      baudrate_verify_deadline_ = 0;
       processCommand(reinterpret_cast<msg_t*>(buffer));
     }
   }
+
+  // Revert to the previous baudrate if the switch was not confirmed.
+  if (baudrate_verify_deadline_ &&
+      (int32_t)(millis() - baudrate_verify_deadline_) >= 0) {
+    DBGln("Baudrate not confirmed, reverting.");
+    baudrate_verify_deadline_ = 0;
+    Serial.end();
+    baudrate_ = baudrate_previous_;
+    Serial.begin(baudrate_);
+    Serial.setTimeout(serial_receive_timeout_);
+  }
 }
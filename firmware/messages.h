@@ -33,8 +33,22 @@ enum msg_type {
   get_status = 3,
   action_IR_send = 4,
   action_IR_received = 5,
+  set_baudrate = 6,
+  set_protocol = 7,
+  action_raw_send = 8,
+  action_raw_received = 9,
+  raw_ack = 10,
+  action_IR_repeat = 11,
 };
 
+// Protocol versions; 1 uses fixed MSG_LENGTH messages, 2 uses COBS frames
+// with a CRC-16 and variable length payloads.
+#define PROTOCOL_V1 1
+#define PROTOCOL_V2 2
+
+// Maximum payload of a version 2 frame, without the CRC.
+#define MAX_PAYLOAD 64
+
 // typedef struct {
   // uint8_t unstaged;
   // uint8_t staged;
@@ -49,19 +63,67 @@ typedef struct {
   uint16_t serial_receive_timeout;
 } msg_config_t;
 
+typedef struct {
+  uint32_t baudrate;
+} msg_baudrate_t;
+
+typedef struct {
+  uint8_t version;
+} msg_protocol_t;
+
+// Flags for the raw chunks.
+#define RAW_FIRST 0x01
+#define RAW_LAST 0x02
+#define RAW_ERROR 0x04
+
+// Resolution of the raw durations in microseconds.
+#define RAW_TICK_US 50
+// Longest duration that can be sent, sendRaw takes 16 bit microseconds.
+#define RAW_MAX_TICKS (0xFFFF / RAW_TICK_US)
+
+#define RAW_CHUNK_SIZE (MSG_LENGTH - 2 - 3)
+
+typedef struct {
+  uint8_t sequence;
+  uint8_t flags;
+  uint8_t length;
+  uint8_t data[RAW_CHUNK_SIZE];
+} msg_raw_chunk_t;
+
 typedef struct {
   uint8_t type;
   uint8_t bits;
   uint32_t value;
 } msg_ir_t;
 
+// A received IR code, stamped with millis() when it was decoded.
+typedef struct {
+  uint8_t type;
+  uint8_t bits;
+  uint32_t value;
+  uint32_t timestamp;
+} msg_ir_received_t;
+
+// An IR code to be sent, followed by count repeats.
+typedef struct {
+  uint8_t type;
+  uint8_t bits;
+  uint32_t value;
+  uint8_t count;
+} msg_ir_repeat_t;
+
 // A struct which represents a message.
 typedef struct {
   msg_type type;
   union {
     msg_ir_t ir_specification;
+    msg_ir_received_t ir_received;
+    msg_ir_repeat_t ir_repeat;
     msg_status_t status;
     msg_config_t config;
+    msg_baudrate_t baudrate;
+    msg_protocol_t protocol;
+    msg_raw_chunk_t raw_chunk;
     // msg_version_t version;
     uint8_t raw[MSG_LENGTH - sizeof(msg_type)];
   };
@@ -71,6 +71,36 @@ def webhook(*args, **kwargs):
     return tmp
 
 
+# factory function to switch to a mode, replacing the top mode.
+def mode(name):
+    def tmp(interactor, action_name):
+        interactor.set_mode(name)
+    return tmp
+
+
+# factory function to cycle through modes, replacing the top mode.
+def toggle_mode(*names):
+    def tmp(interactor, action_name):
+        current = interactor.get_mode()
+        index = names.index(current) + 1 if current in names else 0
+        interactor.set_mode(names[index % len(names)])
+    return tmp
+
+
+# factory function to activate a mode on top of the current ones.
+def push_mode(name):
+    def tmp(interactor, action_name):
+        interactor.push_mode(name)
+    return tmp
+
+
+# factory function to return to the mode below the top mode.
+def pop_mode():
+    def tmp(interactor, action_name):
+        interactor.pop_mode()
+    return tmp
+
+
 # factory function to send out another IR code.
 def emit(name_or_code):
     def tmp(interactor, action_name):
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Analysis of capture files with numpy, see `capture.py` for the format.
+
+    The dtypes in this file mirror the packed `message.Msg` and
+    `message.MsgIRSpecification` structures, such that a capture file is
+    mapped into a structured array without copying or decoding:
+        records = load("ir.capture")
+        events = ir_events(records)
+        print(top_codes(events, 10))
+
+    A report is printed by:
+        python3 -m ir_control.analysis ir.capture --codes samsung_tv
+"""
+
+from . import message
+from .capture import RECORD_SIZE
+
+import ctypes
+import numpy as np
+import os
+
+# mirrors message.MsgIRSpecification
+ir_dtype = np.dtype([("type", "u1"), ("bits", "u1"), ("value", "<u4")])
+
+# mirrors message.Msg, with the body interpreted as an IR specification.
+msg_dtype = np.dtype({"names": ["msg_type", "ir_specification"],
+                      "formats": ["<u2", ir_dtype],
+                      "offsets": [0, 2],
+                      "itemsize": message.PACKET_SIZE})
+
+# a record in a capture file.
+record_dtype = np.dtype({"names": ["timestamp", "msg"],
+                         "formats": ["<f8", msg_dtype],
+                         "offsets": [0, 8],
+                         "itemsize": RECORD_SIZE})
+
+assert ir_dtype.itemsize == ctypes.sizeof(message.MsgIRSpecification)
+assert msg_dtype.itemsize == ctypes.sizeof(message.Msg)
+
+
+def load(path):
+    """
+        Maps a capture file into a structured array of `record_dtype`. A
+        partial record at the end, left by an interrupted capture, is ignored.
+    """
+    count = os.path.getsize(path) // RECORD_SIZE
+    if (count == 0):
+        # a file of length zero cannot be mapped.
+        return np.zeros(0, dtype=record_dtype)
+    return np.memmap(path, dtype=record_dtype, mode="r", shape=(count,))
+
+
+def from_bytes(data):
+    """
+        Interprets bytes holding capture records, without copying.
+    """
+    return np.frombuffer(data, dtype=record_dtype,
+                         count=len(data) // RECORD_SIZE)
+
+
+def ir_events(records):
+    """
+        Selects the action_IR_received records.
+    """
+    return records[records["msg"]["msg_type"] ==
+                   message.msg_type.action_IR_received]
+
+
+def code_keys(events):
+    """
+        Combines type, bits and value of each event into one uint64 key.
+    """
+    ir = events["msg"]["ir_specification"]
+    return (ir["type"].astype(np.uint64) << np.uint64(40)) | \
+        (ir["bits"].astype(np.uint64) << np.uint64(32)) | \
+        ir["value"].astype(np.uint64)
+
+
+def key_to_ir(key):
+    """
+        Converts a key from `code_keys` back into a `message.IR`.
+    """
+    key = int(key)
+    return message.IR(type=key >> 40, bits=(key >> 32) & 0xFF,
+                      value=key & 0xFFFFFFFF)
+
+
+def ir_to_key(ir_code):
+    irtype, bits, value = ir_code.tuple()
+    return (irtype << 40) | (bits << 32) | value
+
+
+def group_by_code(events):
+    """
+        Counts the events per code.
+
+        :returns: tuple of the unique keys and their counts.
+    """
+    return np.unique(code_keys(events), return_counts=True)
+
+
+def top_codes(events, n=10):
+    """
+        Returns the n most frequent codes as a list of (IR, count) tuples.
+    """
+    keys, counts = group_by_code(events)
+    order = np.argsort(counts)[::-1][:n]
+    return [(key_to_ir(keys[i]), int(counts[i])) for i in order]
+
+
+def code_rates(events):
+    """
+        Returns the unique keys and the rate of each in events per second
+        over the duration of the capture.
+    """
+    keys, counts = group_by_code(events)
+    timestamps = events["timestamp"]
+    duration = timestamps.max() - timestamps.min() if len(events) > 1 else 0
+    return keys, counts / duration if duration else counts * 0.0
+
+
+def inter_arrival_histogram(events, bins=50, max_interval=1.0):
+    """
+        Histogram of the time between consecutive events, in seconds.
+
+        :returns: tuple of counts and bin edges, like `numpy.histogram`.
+    """
+    intervals = np.diff(events["timestamp"])
+    return np.histogram(intervals, bins=bins, range=(0.0, max_interval))
+
+
+def repeat_runs(events, max_gap=0.25):
+    """
+        Finds runs of identical codes, where each follows the previous within
+        max_gap seconds, such as those of a held key or a repeat storm.
+
+        :returns: tuple of the start index of each run and its length.
+    """
+    if (len(events) == 0):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = code_keys(events)
+    gaps = np.diff(events["timestamp"])
+    new_run = np.concatenate(([True], (keys[1:] != keys[:-1]) |
+                              (gaps > max_gap)))
+    starts = np.flatnonzero(new_run)
+    lengths = np.diff(np.concatenate((starts, [len(events)])))
+    return starts, lengths
+
+
+def unknown_codes(events, known):
+    """
+        Tallies the codes that are not known.
+
+        :param known: The known codes.
+        :type known: iterable of `message.IR`
+        :returns: list of (IR, count) tuples, most frequent first.
+    """
+    known_keys = np.array([ir_to_key(c) for c in known], dtype=np.uint64)
+    keys = code_keys(events)
+    unknown = events[~np.isin(keys, known_keys)]
+    return top_codes(unknown, len(unknown))
+
+
+def report(records, known=None, top=10, storm_length=10):
+    """
+        Returns a text report on the records of a capture.
+    """
+    lines = []
+    events = ir_events(records)
+    lines.append("{} records, {} IR events.".format(len(records),
+                                                     len(events)))
+    if (len(events) == 0):
+        return "\n".join(lines)
+    timestamps = events["timestamp"]
+    duration = timestamps[-1] - timestamps[0]
+    lines.append("Duration {:.1f} s, {:.3f} events/s.".format(
+        duration, len(events) / duration if duration else 0.0))
+
+    lines.append("\nTop {} codes:".format(top))
+    for code, count in top_codes(events, top):
+        lines.append("  {: <30s} {: >10d} {: >10.4f}/s".format(
+            code.config_print(), count, count / duration if duration else 0))
+
+    intervals = np.diff(timestamps)
+    if (len(intervals)):
+        percentiles = np.percentile(intervals, [1, 50, 90, 99])
+        lines.append("\nInter-arrival time (ms): p1 {:.1f}, p50 {:.1f}, "
+                     "p90 {:.1f}, p99 {:.1f}".format(*(percentiles * 1000)))
+
+    starts, lengths = repeat_runs(events)
+    storms = lengths >= storm_length
+    lines.append("\nRepeat runs: {}, longest {}, {} of at least {}.".format(
+        len(lengths), int(lengths.max()), int(storms.sum()), storm_length))
+
+    if (known is not None):
+        unknown = unknown_codes(events, known)
+        lines.append("\nUnknown codes: {} distinct, {} events.".format(
+            len(unknown), sum(c for _, c in unknown)))
+        for code, count in unknown[:top]:
+            lines.append("  {: <30s} {: >10d}".format(code.config_print(),
+                                                      count))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    from .config import Configurator
+
+    parser = argparse.ArgumentParser(description="Report on a capture file.")
+    parser.add_argument('capture', help="The capture file.")
+    parser.add_argument('--codes', '-c', help="Code file with the known codes,"
+                        " can be given multiple times.", action="append",
+                        default=[])
+    parser.add_argument('--top', '-n', help="Number of codes to list.",
+                        default=10, type=int)
+    args = parser.parse_args()
+
+    known = None
+    if (args.codes):
+        conf = Configurator()
+        for path in args.codes:
+            conf.load_codes(path)
+        known = conf.get_codes().keys()
+    print(report(load(args.capture), known=known, top=args.top))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Benchmarks for the startup and throughput, run in fresh interpreters and
+    against the simulated MCU of `soak.py`:
+
+        - imports: the time `python -X importtime` reports for
+          `import ir_control` and `import ir_control.message`, these must
+          stay cheap for scripts that are started often.
+        - startup: a one-shot `action_IR_send` and `get_status` with the
+          interface commandline tool, from starting the interpreter until
+          it exits. Scripted sends should take tens of milliseconds.
+        - throughput: get_status round trips per second at each baudrate
+          that can be negotiated, this needs the port of a real MCU with
+          --port. The simulated MCU is on a pseudo terminal, which has no
+          speed, so its numbers would say nothing about the serial link.
+        - logging: the time the main loop spends per debug call for a
+          received code at the DEBUG, INFO and WARNING levels, with the
+          records written by the QueueListener as `start()` does and with
+          the handler called directly as before.
+
+    The best of several runs is compared to the budgets, the exit status is
+    1 if any of them is exceeded:
+        python3 -m ir_control.benchmark
+        python3 -m ir_control.benchmark throughput --port /dev/ttyACM0
+"""
+
+from . import message
+from .control import LogQueueHandler
+from .interface import exchange, negotiate_baudrate, wait_ready
+from .soak import BAUDRATES, SimulatedDevice
+
+import logging
+import logging.handlers
+import os
+import queue
+import serial
+import subprocess
+import sys
+import time
+
+# the directory holding the package, such that the child interpreters
+# import this copy of it.
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(arguments, **kwargs):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [_ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+    return subprocess.run([sys.executable] + arguments, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, **kwargs)
+
+
+def import_time(module, runs=5):
+    """
+        Returns the shortest time in seconds it took to import the module in
+        a fresh interpreter, as reported by `-X importtime`. Only the
+        imports made for the module are counted, not those of the
+        interpreter's own startup.
+    """
+    best = None
+    for i in range(runs):
+        result = _run(["-X", "importtime", "-c", "import " + module],
+                      check=True)
+        total = 0
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if (not line.startswith("import time:")) or (len(fields) != 3):
+                continue
+            # nested imports are indented, these are in the cumulative time.
+            name = fields[2][1:]
+            if (name.startswith(" ")) or not (
+                    name == "ir_control" or name.startswith("ir_control.")):
+                continue
+            total += int(fields[1])
+        best = total if best is None else min(best, total)
+    return best / 1e6
+
+
+def startup_time(serial_port, command, runs=5):
+    """
+        Returns the shortest time in seconds of a one-shot command with
+        `python -m ir_control.interface`, or None if it failed.
+
+        :param command: The command and its arguments.
+        :type command: list of str
+    """
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        result = _run(["-m", "ir_control.interface", "--port", serial_port] +
+                      command)
+        duration = time.perf_counter() - start
+        if (result.returncode != 0):
+            print(result.stdout + result.stderr)
+            return None
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def round_trips(ser, duration):
+    """
+        Returns the number of get_status round trips per second.
+    """
+    msg = message.Msg()
+    msg.msg_type = msg.type.get_status
+    count = 0
+    start = time.monotonic()
+    while (time.monotonic() - start < duration):
+        if (exchange(ser, msg, timeout=0.5) is not None):
+            count += 1
+    return count / (time.monotonic() - start)
+
+
+def log_overhead(level, queued, count=20000):
+    """
+        Returns the time in seconds spent by the caller per debug call of
+        the main loop for a received code. With `queued` the records go
+        through a `LogQueueHandler` to a QueueListener, as set up by
+        `start()`, otherwise the handler formats and writes them directly.
+    """
+    stream = open(os.devnull, "w")
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(name)s - %(asctime)s - "
+                                           "%(levelname)s - %(message)s"))
+    logger = logging.getLogger("ir_control.benchmark.log")
+    logger.propagate = False
+    logger.setLevel(level)
+    listener = None
+    if (queued):
+        listener = logging.handlers.QueueListener(queue.Queue(), handler)
+        logger.addHandler(LogQueueHandler(listener.queue))
+        listener.start()
+    else:
+        logger.addHandler(handler)
+
+    ir_code = message.IR(type=message.IR_type.NEC, bits=32, value=0x20DF10EF)
+    code = ir_code.tuple()
+    start = time.perf_counter()
+    for i in range(count):
+        logger.debug("IR code %s matched to: %s", ir_code, "tv_power",
+                     extra={"code": code, "ir_name": "tv_power"})
+    duration = time.perf_counter() - start
+
+    if (listener is not None):
+        listener.stop()  # writes the remaining records.
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    stream.close()
+    return duration / count
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the import "
+                                     "time, startup and throughput.")
+    parser.add_argument("benchmarks", nargs="*", help="The benchmarks to "
+                        "run, imports, startup, throughput (with --port) and "
+                        "logging by default.")
+    parser.add_argument("--port", default=None, help="Serial port of a real "
+                        "MCU, the simulated one is used otherwise. Required "
+                        "for the throughput.")
+    parser.add_argument("--runs", default=5, type=int,
+                        help="Number of runs of which the best is used.")
+    parser.add_argument("--duration", default=2.0, type=float,
+                        help="Seconds to measure each baudrate.")
+    parser.add_argument("--package-budget", default=10.0, type=float,
+                        help="Milliseconds for importing ir_control.")
+    parser.add_argument("--message-budget", default=30.0, type=float,
+                        help="Milliseconds for importing ir_control.message.")
+    parser.add_argument("--startup-budget", default=100.0, type=float,
+                        help="Milliseconds for a one-shot command.")
+    args = parser.parse_args()
+    names = ("imports", "startup", "throughput", "logging")
+    benchmarks = args.benchmarks or [name for name in names if (
+        name != "throughput") or (args.port is not None)]
+    for name in benchmarks:
+        if (name not in names):
+            parser.error("Unknown benchmark {}".format(name))
+    if ("throughput" in benchmarks) and (args.port is None):
+        parser.error("The throughput can only be measured with --port.")
+
+    device = None
+    serial_port = args.port
+    if (serial_port is None):
+        device = SimulatedDevice(0)
+        device.start()
+        serial_port = device.path
+
+    failed = False
+
+    def check(name, value, budget):
+        exceeded = (value is None) or (value * 1000 > budget)
+        print("{:28s} {:>9s} ms, budget {:.1f} ms{}".format(
+              name, "-" if value is None else "{:.1f}".format(value * 1000),
+              budget, " EXCEEDED" if exceeded else ""))
+        return exceeded
+
+    if ("imports" in benchmarks):
+        for module, budget in (("ir_control", args.package_budget),
+                               ("ir_control.message", args.message_budget)):
+            failed |= check("import " + module,
+                            import_time(module, args.runs), budget)
+
+    if ("startup" in benchmarks):
+        send = ["action_IR_send", '{"type": 1, "bits": 32, '
+                '"value": 551489775}']
+        for name, command in (("one-shot action_IR_send", send),
+                              ("one-shot get_status", ["get_status"])):
+            failed |= check(name, startup_time(serial_port, command,
+                                               args.runs),
+                            args.startup_budget)
+
+    if ("throughput" in benchmarks):
+        print("\n baudrate  round trips/s  link limit/s")
+        ser = serial.Serial(serial_port, 9600,
+                            timeout=message.PACKET_SIZE * (1.1 / 9600))
+        wait_ready(ser)
+        for baudrate in BAUDRATES:
+            if (negotiate_baudrate(ser, baudrate) != baudrate):
+                print("{:9d}  not supported".format(baudrate))
+                continue
+            # ten bits per byte, and a request and a reply per round trip.
+            print("{:9d}  {:13.1f}  {:12.1f}".format(
+                  baudrate, round_trips(ser, args.duration),
+                  baudrate / 10.0 / message.PACKET_SIZE / 2))
+        ser.close()
+
+    if ("logging" in benchmarks):
+        print("\n level     queued us/call  direct us/call")
+        for level in ("DEBUG", "INFO", "WARNING"):
+            print("{:8s}  {:14.2f}  {:14.2f}".format(
+                  level, log_overhead(level, True) * 1e6,
+                  log_overhead(level, False) * 1e6))
+
+    if (device is not None):
+        device.stop()
+    print("FAILED" if failed else "PASSED")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
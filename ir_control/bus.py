@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Shared memory event bus to fan received IR codes out to local processes.
+
+    The publisher owns a ring buffer in a `multiprocessing.shared_memory`
+    block. Every received code is written into the next slot together with a
+    sequence number, any number of subscribers can read the ring without
+    involving the publisher. Reading is a memory access only, no syscalls are
+    made on the hot path.
+
+    Each slot is guarded with its sequence number in the style of a seqlock;
+    the publisher invalidates the slot, writes the payload and then writes
+    the sequence number. A subscriber copies the slot and checks that the
+    sequence number is the one it expected both before and after copying. If
+    a subscriber falls behind more than the ring size, the lost events are
+    counted and it continues at the oldest event still available.
+
+    Publishing, this is done by `start()` if `--bus NAME` is passed:
+        bus = EventBus("ir_control")
+        interactor.add_listener(bus.listener)
+
+    Subscribing, from any other process:
+        sub = Subscriber("ir_control")
+        while True:
+            for event in sub.wait():
+                print(event.name, event.code)
+"""
+
+from . import message
+
+from collections import namedtuple
+from multiprocessing import shared_memory
+import struct
+import time
+
+# Header: magic, version, slot count, slot size, write sequence.
+_HEADER = struct.Struct("<4sHHIQ")
+_MAGIC = b"IRCB"
+_VERSION = 1
+
+# Slot: sequence, timestamp, type, bits, value, name.
+NAME_LENGTH = 48
+_SLOT = struct.Struct("<QdHBxI{}s".format(NAME_LENGTH))
+_SLOT_SEQ = struct.Struct("<Q")
+
+# The offset of the write sequence in the header.
+_HEADER_SEQ_OFFSET = _HEADER.size - _SLOT_SEQ.size
+
+# An event read from the bus, code is a `message.IR` instance, name is the
+# ir_name or an empty string if the code is not known.
+Event = namedtuple("Event", ["seq", "timestamp", "name", "code"])
+
+
+def _attach(name):
+    # Attaching registers the block with the resource tracker on most Python
+    # versions, which would unlink it when the subscriber exits. The block is
+    # owned by the publisher, so prevent that.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except (ImportError, AttributeError):
+            pass
+        return shm
+
+
+class EventBus:
+    """
+        Publishes received IR codes into a shared memory ring buffer.
+
+        :param name: The name of the shared memory block.
+        :type name: str
+        :param slots: The number of events kept in the ring.
+        :type slots: int
+    """
+    def __init__(self, name, slots=256):
+        self.name = name
+        self.slots = slots
+        size = _HEADER.size + slots * _SLOT.size
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=size)
+        except FileExistsError:
+            # left over from a previous run that did not shut down cleanly.
+            old = _attach(name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=size)
+        self.buf = self.shm.buf
+        self.seq = 0
+        _HEADER.pack_into(self.buf, 0, _MAGIC, _VERSION, slots, _SLOT.size,
+                          self.seq)
+
+    def publish(self, ir_code, ir_name=None, timestamp=None):
+        """
+            Writes an event into the next slot of the ring.
+
+            :param ir_code: The received code.
+            :type ir_code: `message.IR`
+            :param ir_name: The name of the code, if known.
+            :type ir_name: str
+            :param timestamp: Time of receipt, defaults to `time.time()`.
+            :type timestamp: float
+        """
+        seq = self.seq + 1
+        offset = _HEADER.size + (seq % self.slots) * _SLOT.size
+        irtype, bits, value = ir_code.tuple()
+        name = (ir_name or "").encode("utf-8")[:NAME_LENGTH]
+        timestamp = time.time() if timestamp is None else timestamp
+
+        # invalidate the slot, write the payload, then the sequence number.
+        _SLOT_SEQ.pack_into(self.buf, offset, 0)
+        _SLOT.pack_into(self.buf, offset, 0, timestamp, irtype, bits, value,
+                        name)
+        _SLOT_SEQ.pack_into(self.buf, offset, seq)
+        _SLOT_SEQ.pack_into(self.buf, _HEADER_SEQ_OFFSET, seq)
+        self.seq = seq
+
+    # Listener signature, such that it can be passed to add_listener.
+    def listener(self, interactor, ir_code, ir_name):
+        self.publish(ir_code, ir_name, interactor.received_time)
+
+    def close(self):
+        """
+            Closes and removes the shared memory block.
+        """
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class Subscriber:
+    """
+        Reads events from a shared memory ring written by an `EventBus`.
+
+        :param name: The name of the shared memory block.
+        :type name: str
+        :param from_start: Start at the oldest event still in the ring instead
+            of only returning new events.
+        :type from_start: bool
+    """
+    def __init__(self, name, from_start=False):
+        self.shm = _attach(name)
+        self.buf = self.shm.buf
+        magic, version, self.slots, slot_size, seq = _HEADER.unpack_from(
+            self.buf, 0)
+        if (magic != _MAGIC) or (version != _VERSION) or (
+                slot_size != _SLOT.size):
+            self.shm.close()
+            raise ValueError("{} is not a compatible event bus.".format(name))
+        self.seq = max(0, seq - self.slots) if from_start else seq
+        self.lost = 0  # number of events that were overwritten before read.
+
+    def _head(self):
+        return _SLOT_SEQ.unpack_from(self.buf, _HEADER_SEQ_OFFSET)[0]
+
+    def poll(self):
+        """
+            Returns the events published since the last call, without waiting.
+
+            :returns: list of `Event` instances.
+        """
+        events = []
+        head = self._head()
+        while (self.seq < head):
+            seq = self.seq + 1
+            if (head - seq >= self.slots):
+                # we fell behind, skip to the oldest slot that is still valid.
+                skip = head - self.slots + 1
+                self.lost += skip - seq
+                self.seq = skip - 1
+                continue
+            offset = _HEADER.size + (seq % self.slots) * _SLOT.size
+            slot_seq, timestamp, irtype, bits, value, name = \
+                _SLOT.unpack_from(self.buf, offset)
+            if (slot_seq != seq) or (
+                    _SLOT_SEQ.unpack_from(self.buf, offset)[0] != seq):
+                # overwritten while we were reading it, reread the head such
+                # that the check above skips to the valid slots.
+                head = self._head()
+                continue
+            code = message.IR(type=irtype, bits=bits, value=value)
+            events.append(Event(seq, timestamp,
+                                name.rstrip(b"\x00").decode("utf-8",
+                                                            "replace"),
+                                code))
+            self.seq = seq
+        return events
+
+    def wait(self, timeout=None, interval=0.001):
+        """
+            Waits until at least one event is available and returns those.
+
+            :param timeout: Maximum time to wait in seconds, None waits
+                forever.
+            :type timeout: float
+            :param interval: The polling interval in seconds.
+            :type interval: float
+            :returns: list of `Event` instances, empty on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while (True):
+            events = self.poll()
+            if (events) or (deadline is not None and
+                            time.monotonic() >= deadline):
+                return events
+            time.sleep(interval)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+if __name__ == "__main__":
+    # Print the events on a bus.
+    import sys
+    sub = Subscriber(sys.argv[1] if len(sys.argv) > 1 else "ir_control")
+    try:
+        while (True):
+            for event in sub.wait():
+                print("{} {:.3f} {} {}".format(event.seq, event.timestamp,
+                                               event.name,
+                                               event.code.config_print()))
+            if (sub.lost):
+                print("Lost {} events.".format(sub.lost))
+                sub.lost = 0
+    except KeyboardInterrupt:
+        pass
+    sub.close()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Capture files hold the messages received from the serial port, each with
+    the time of receipt. Every record is 24 bytes; the timestamp in seconds
+    as a little endian double followed by the 16 byte message as it is sent
+    by the firmware. The fixed layout allows `analysis.py` to map a capture
+    file directly into numpy arrays.
+
+    Captures are written by `start()` when it is passed `--capture FILE`.
+"""
+
+from . import message
+
+import struct
+import time
+
+_TIMESTAMP = struct.Struct("<d")
+
+RECORD_SIZE = _TIMESTAMP.size + message.PACKET_SIZE
+
+
+class CaptureWriter:
+    """
+        Appends received messages to a capture file.
+
+        :param path: The file to append to.
+        :type path: str
+        :param flush_interval: Seconds between flushes of the file.
+        :type flush_interval: float
+    """
+    def __init__(self, path, flush_interval=1.0):
+        self.f = open(path, "ab")
+        self.flush_interval = flush_interval
+        self.flushed_at = time.monotonic()
+
+    def write(self, msg, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        self.f.write(_TIMESTAMP.pack(timestamp) + bytes(msg))
+        if (time.monotonic() - self.flushed_at > self.flush_interval):
+            self.f.flush()
+            self.flushed_at = time.monotonic()
+
+    def close(self):
+        self.f.close()
+
+
+def read_captures(path):
+    """
+        Reads a capture file without numpy, yields (timestamp, msg) tuples.
+    """
+    with open(path, "rb") as f:
+        while (True):
+            record = f.read(RECORD_SIZE)
+            if (len(record) < RECORD_SIZE):
+                return
+            yield (_TIMESTAMP.unpack_from(record)[0],
+                   message.Msg.read(record[_TIMESTAMP.size:]))
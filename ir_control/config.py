@@ -1,12 +1,28 @@
 from .message import IR, IR_type_id
+from collections import namedtuple
 import os
 import sys
 
+# A mode is a layer of actions, see Configurator.mode.
+Mode = namedtuple("Mode", ["actions", "repeat"])
+
 
 def perror(a):
     sys.stderr.write(a + "\n")
     sys.stderr.flush()
 
+
+# Writes codes in the format read by Configurator.load_codes, codes is a dict
+# of IR code: name, where the names do not include the prefix.
+def write_code_file(path, codes, prefix=None, comment=None):
+    with open(path, 'w') as f:
+        for line in (comment.splitlines() if comment else []):
+            f.write("# {}\n".format(line))
+        if (prefix):
+            f.write("@prefix {}\n".format(prefix))
+        for code, name in codes.items():
+            f.write("{} {}\n".format(code.config_print(), name))
+
 """
     Maps IR codes to names, when receiving, several codes can point to the same
     name. Sending to a name with multiple ir codes associated to it sends the
@@ -46,6 +62,27 @@ def perror(a):
 
     Registers an action for the name "multi_tv_blue", the second argument is an
     callable that is called with:  function(interactor, action_name).
+
+    Modes are named layers of actions, the active modes form a stack on top of
+    the actions registered with `action`. Names that are not in a mode fall
+    through to the modes below it:
+        conf.mode("pc", {"up": shell("amixer sset Master 2%+")}, repeat=True)
+        conf.mode("mpd", {"up": shell("mpc volume +2")}, repeat=False)
+        conf.action("menu", toggle_mode("pc", "mpd"))
+        conf.set_default_mode("pc")
+
+    If the name of the repeat code is set with `set_repeat_name`, receiving it
+    repeats the last action if the top mode allows that; repeat is True, False
+    or a collection of names whose actions may be repeated.
+
+    Actions can also be bound to sequences of names, these are performed when
+    the names are received in that order, each within the timeout:
+        conf.sequence(["menu", "key_1", "key_2"], shell("mpc play 12"))
+
+    Received codes that are not known can be matched to the nearest known code
+    with the same type and bit count, if they differ by at most a number of
+    bits:
+        conf.set_tolerance(2)
 """
 
 
@@ -53,6 +90,12 @@ class Configurator():
     def __init__(self):
         self.ir_codes = {}
         self.ir_actions = {}
+        self.tolerance = 0
+        self.modes = {}
+        self.default_mode = None
+        self.repeat_name = None
+        self.sequences = []
+        self.sequence_timeout = 1.0
 
     def load_codes(self, path, prefix=None):
         # try in the current folder.
@@ -160,3 +203,39 @@ class Configurator():
 
     def get_codes(self):
         return self.ir_codes
+
+    def mode(self, name, actions, repeat=True):
+        self.modes[name] = Mode(actions=dict(actions), repeat=repeat)
+
+    def get_modes(self):
+        return self.modes
+
+    def set_default_mode(self, name):
+        self.default_mode = name
+
+    def get_default_mode(self):
+        return self.default_mode
+
+    def set_repeat_name(self, name):
+        self.repeat_name = name
+
+    def get_repeat_name(self):
+        return self.repeat_name
+
+    def sequence(self, names, callable, timeout=None):
+        self.sequences.append((list(names), callable, timeout))
+
+    def get_sequences(self):
+        return self.sequences
+
+    def set_sequence_timeout(self, timeout):
+        self.sequence_timeout = timeout
+
+    def get_sequence_timeout(self):
+        return self.sequence_timeout
+
+    def set_tolerance(self, max_distance):
+        self.tolerance = max_distance
+
+    def get_tolerance(self):
+        return self.tolerance
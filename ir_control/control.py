@@ -0,0 +1,687 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from .interface import SerialInterface, ProcessSerialInterface, MessageQueue
+from . import message
+from . import raw
+from .sequence import SequenceRecognizer
+
+import json
+import queue
+import socket
+import socketserver
+import threading
+import time
+import logging
+import logging.handlers
+
+
+class IR_Control:
+    def __init__(self, interface, serial_port, baudrate):
+        self.i = interface
+        self.serial_port = serial_port
+        self.baudrate = baudrate
+        self.log = logging.getLogger("IR_Control")
+        self.running = True
+        self.listeners = []
+        self.raw_assembler = raw.RawAssembler()
+        self.capture = None  # a capture.CaptureWriter to record messages.
+        self.heartbeat = None  # a heartbeat.Heartbeat to monitor the MCU.
+        self.received_time = None  # time.time() the last code was received.
+
+    def stop(self):
+        self.running = False
+
+    # blocks reading from serial port and acting appropriately. The interface
+    # reconnects to the serial port by itself.
+    def loop(self):
+        connected = True
+        while(self.running):
+            if (connected != self.i.is_serial_connected()):
+                connected = not connected
+                if (connected):
+                    self.log.info("Serial port connected.")
+                else:
+                    self.log.error("No serial port, reconnecting.")
+                if (self.heartbeat is not None):
+                    self.heartbeat.reset()  # the MCU resets on connecting.
+            a = self.i.get_message()
+            if (a):
+                self.received_serial(a)
+            self.poll()
+            if (not a):
+                time.sleep(0.001)
+
+    # processes received messages from serial
+    def received_serial(self, msg):
+        self.received_time = time.time()
+        if (self.heartbeat is not None):
+            if (msg.msg_type == msg.type.get_status):
+                self.heartbeat.reply(msg, time.monotonic())
+            elif (msg.msg_type == msg.type.action_IR_received):
+                # the time at which the MCU received it.
+                self.received_time = self.heartbeat.stamp(
+                    msg.ir_received.timestamp, self.received_time)
+        if (self.capture is not None):
+            self.capture.write(msg, self.received_time)
+        # receives messages from the interface.
+        if (msg.msg_type == msg.type.action_IR_received):
+            # convert it into a ir_message
+            ir_code = message.IR(**dict(msg.ir_specification))
+            self.ir_received(ir_code)
+        elif (msg.msg_type == msg.type.action_raw_received):
+            durations = self.raw_assembler.feed(msg)
+            if (durations is not None):
+                self.raw_received(durations)
+
+    # sends a message over the serial port
+    def send_serial(self, msg):
+        try:
+            self.i.put_message(msg)
+        except queue.Full:
+            self.log.warn("Send queue full, discarded {}".format(msg))
+
+    # returns the counts of discarded messages and similar statistics.
+    def get_statistics(self):
+        stats = {"drops": self.i.get_drop_counts(),
+                 "outages": self.i.get_outage_statistics(),
+                 "frame_errors": self.i.get_frame_errors()}
+        matcher = getattr(self, "ir_matcher", None)
+        if (matcher is not None):
+            stats["tolerant"] = {"matches": matcher.matches,
+                                 "ambiguous": matcher.ambiguous}
+        if (self.heartbeat is not None):
+            stats["heartbeat"] = self.heartbeat.get_statistics()
+        return stats
+
+    # send an IR code with the hardware.
+    def send_ir(self, ir_code):
+        self.log.debug("sending ir %s", ir_code,
+                       extra={"code": ir_code.tuple()})
+        # create the message
+        msg = message.Msg()
+        msg.msg_type = msg.type.action_IR_send
+        try:
+            msg.ir_specification.from_dict(ir_code.raw())
+        except TypeError as e:
+            self.log.error("Conversion failed: {} ".format(str(e)))
+        self.send_serial(msg)
+
+    # send raw mark and space durations in microseconds with the hardware.
+    def send_raw(self, durations, frequency=38000):
+        self.log.debug("sending %d raw durations", len(durations))
+        try:
+            msgs = raw.send_messages(durations, frequency)
+        except ValueError as e:
+            self.log.error("Raw code not sent: {}".format(str(e)))
+            return
+        for msg in msgs:
+            self.send_serial(msg)
+
+    # send a learned PRONTO hex code with the hardware.
+    def send_pronto(self, text):
+        try:
+            frequency, durations = raw.parse_pronto(text)
+        except ValueError as e:
+            self.log.error("Invalid PRONTO code: {}".format(str(e)))
+            return
+        self.send_raw(durations, frequency)
+
+    # This method is called when an IR code is received from the serial port.
+    def ir_received(self, ir_code):
+        raise NotImplementedError("Subclass should implement this.")
+
+    # This method is called regularly by the loop, for things that time out.
+    def poll(self):
+        if (self.heartbeat is not None) and (self.i.is_serial_connected()):
+            msg = self.heartbeat.poll(time.monotonic())
+            if (msg is not None):
+                self.send_serial(msg)
+
+    # This method is called with the durations in microseconds when the raw
+    # timings of a code the firmware could not decode are received.
+    def raw_received(self, durations):
+        if (self.log.isEnabledFor(logging.DEBUG)):
+            self.log.debug("Raw IR code received: %s",
+                           " ".join(str(d) for d in durations))
+
+    # Register a callable that is called for every received IR code with:
+    # function(interactor, ir_code, ir_name), ir_name is None if not known.
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def notify_listeners(self, ir_code, ir_name):
+        for listener in self.listeners:
+            try:
+                listener(self, ir_code, ir_name)
+            except Exception as e:
+                self.log.error("Listener {} failed: {}".format(listener, e))
+
+
+# This object actually deals with the interaction and configuration file
+# it is up to you to change this to suit your needs... or use this and modify
+# the configuration file.
+class Interactor(IR_Control):
+    def __init__(self, *args, **kwargs):
+        super(Interactor, self).__init__(*args, **kwargs)
+        self.log = logging.getLogger("Interactor")
+        self.decode_raw = None  # loaded when the first raw code arrives.
+        self.received_at = time.monotonic()  # for the action latency.
+
+    def load_config(self, conf):
+        self.ir_by_name = {}
+        self.ir_by_code = {}
+
+        ir_codes = conf.get_codes()
+        for code in ir_codes:
+            name = ir_codes[code]
+            # store lookup for name -> ir_code and ir_code -> name.
+            self.ir_by_name[name] = code
+            self.ir_by_code[code.tuple()] = name
+
+        # store actions per name.
+        self.ir_actions = conf.get_actions()
+
+        # the mode layers, these are compiled into self.dispatch.
+        self.modes = conf.get_modes()
+        self.repeat_name = conf.get_repeat_name()
+        default_mode = conf.get_default_mode()
+        self.mode_stack = [] if default_mode is None else [default_mode]
+        self.compile_modes()
+
+        # the sequences of names that actions are bound to.
+        self.sequences = None
+        if (conf.get_sequences()):
+            self.sequences = SequenceRecognizer(conf.get_sequence_timeout(),
+                                                self.repeat_name)
+            for names, action, timeout in conf.get_sequences():
+                self.sequences.bind(names, action, timeout)
+
+        # index to match codes with flipped bits to the nearest known code.
+        self.ir_matcher = None
+        if (conf.get_tolerance()):
+            from .matcher import HammingIndex
+            self.ir_matcher = HammingIndex(self.ir_by_code,
+                                           conf.get_tolerance())
+
+    # called when an ir code is received from the serial port.
+    def ir_received(self, ir_code):
+        self.received_at = time.monotonic()
+        code = ir_code.tuple()
+        ir_name = self.ir_by_code.get(code)
+        if (ir_name is None) and (self.ir_matcher is not None):
+            # try the nearest known code, in case some bits were flipped.
+            ir_name = self.ir_matcher.lookup(code)
+            if (ir_name is not None):
+                self.log.debug("IR code %s matched to: %s", ir_code, ir_name,
+                               extra={"code": code, "ir_name": ir_name})
+
+        if (ir_name is not None):
+            self.log.debug("IR name known: %s", ir_name,
+                           extra={"code": code, "ir_name": ir_name})
+            self.notify_listeners(ir_code, ir_name)
+            # try to perform the action:
+            if (self.sequences is not None):
+                self.perform_sequences(self.sequences.feed(ir_name,
+                                                           time.monotonic()))
+            else:
+                self.perform_action(ir_name)
+        else:
+            if (self.log.isEnabledFor(logging.DEBUG)):
+                self.log.debug("IR code not known:\n%s",
+                               ir_code.config_print(),
+                               extra={"code": code})
+            self.notify_listeners(ir_code, None)
+
+    # called with the raw durations of a code the firmware could not decode,
+    # these are decoded here if numpy is available.
+    def raw_received(self, durations):
+        if (self.decode_raw is None):
+            try:
+                from .decoder import decode
+                self.decode_raw = decode
+            except ImportError as e:
+                self.log.warn("Raw codes are not decoded, numpy is missing.")
+                self.decode_raw = False
+        ir_code = self.decode_raw(durations) if self.decode_raw else None
+        if (ir_code is None):
+            super(Interactor, self).raw_received(durations)
+            return
+        self.log.debug("Decoded raw code: %s", ir_code,
+                       extra={"code": ir_code.tuple()})
+        self.ir_received(ir_code)
+
+    # Flattens the actions and the active modes into one lookup table, such
+    # that performing an action is a single lookup regardless of the modes.
+    def compile_modes(self):
+        dispatch = dict(self.ir_actions)
+        repeat = True
+        for name in self.mode_stack:
+            if (name not in self.modes):
+                # only the default mode can get here without a check.
+                raise ValueError("Mode {} is not defined, define it with "
+                                 "Configurator.mode.".format(name))
+            mode = self.modes[name]
+            dispatch.update(mode.actions)
+            repeat = mode.repeat
+        self.dispatch = dispatch
+        self.repeat = repeat
+        self.last_action = None
+
+    # Replaces the top mode, or sets it if there are no active modes.
+    def set_mode(self, name):
+        if (name not in self.modes):
+            self.log.warn("Tried to set unknown mode {}".format(name))
+            return
+        self.mode_stack[-1:] = [name]
+        self.log.info("Mode: {}".format(" > ".join(self.mode_stack)))
+        self.compile_modes()
+
+    def push_mode(self, name):
+        if (name not in self.modes):
+            self.log.warn("Tried to push unknown mode {}".format(name))
+            return
+        self.mode_stack.append(name)
+        self.log.info("Mode: {}".format(" > ".join(self.mode_stack)))
+        self.compile_modes()
+
+    def pop_mode(self):
+        if (self.mode_stack):
+            self.mode_stack.pop()
+        self.log.info("Mode: {}".format(" > ".join(self.mode_stack)))
+        self.compile_modes()
+
+    def get_mode(self):
+        return self.mode_stack[-1] if self.mode_stack else None
+
+    # When an IR code is received and we have a name for this, this performs
+    # the action associated to that name.
+    def perform_action(self, action_name):
+        if (action_name == self.repeat_name) and (self.last_action):
+            # repeat the last action, if the current mode allows it.
+            action, repeated_name = self.last_action
+            if (self.repeat is True) or (
+                    self.repeat and repeated_name in self.repeat):
+                action(self, repeated_name)
+            return
+
+        action = self.dispatch.get(action_name)
+        if (action is None):
+            return
+        self.log.info("Action found for %s.", action_name,
+                      extra={"ir_name": action_name, "latency":
+                             time.monotonic() - self.received_at})
+        if (action_name != self.repeat_name):
+            self.last_action = (action, action_name)
+
+        # call the action, with the interactor and action_name argument.
+        action(self, action_name)
+
+    # performs the results of the sequence recognizer.
+    def perform_sequences(self, results):
+        for action, names in results:
+            if (action is None):
+                self.perform_action(names[0])
+                continue
+            action_name = ",".join(names)
+            self.log.info("Sequence found for %s.", action_name,
+                          extra={"ir_name": action_name})
+            action(self, action_name)
+
+    # resolves sequences of which the timeout expired.
+    def poll(self):
+        super(Interactor, self).poll()
+        if (self.sequences is not None) and (self.sequences.deadline):
+            self.perform_sequences(self.sequences.poll(time.monotonic()))
+
+    # send an IR code by name.
+    def send_ir_by_name(self, name):
+        if name in self.ir_by_name:
+            self.send_ir(self.ir_by_name[name])
+        else:
+            self.log.warn("Tried to send unknown {} ir code".format(name))
+
+    # this method is called when something is passed via the TCP socket.
+    def incoming_external_command(self, cmd):
+        cmd = str(cmd, 'ascii')
+        self.log.debug("Incoming command: %s", cmd)
+        self.send_ir_by_name(cmd)
+        # self.perform_action(cmd)
+
+
+# A client that subscribed to the received IR codes over the TCP socket.
+class Subscription:
+    def __init__(self, request, prefix, size, policy):
+        self.request = request
+        self.prefix = prefix
+        self.policy = policy
+        self.events = queue.Queue(maxsize=size)
+        self.dropped = 0
+        self.closed = False
+
+    # Called from the Interactor's main loop for every received code, via the
+    # listener of the server, so this must never block.
+    def offer(self, ir_name, data):
+        if (self.closed):
+            return
+        if (self.prefix) and not (ir_name or "").startswith(self.prefix):
+            return
+        try:
+            self.events.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+            if (self.policy == "disconnect"):
+                self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            # unblocks the handler thread if it is stuck in sendall.
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class TCPCommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        data = self.request.recv(1024).strip()
+        if (data.startswith(b"subscribe")):
+            self.subscribe(str(data[len(b"subscribe"):].strip(), 'ascii'))
+            return
+        if (data == b"stats"):
+            stats = self.server.mcu_manager_.get_statistics()
+            self.request.sendall(bytes(json.dumps(stats) + "\n", 'ascii'))
+            return
+        self.server.mcu_manager_.incoming_external_command(data)
+        self.finish()
+
+    # Keeps the connection open and streams the received IR codes as lines of
+    # json, optionally only those of which the name starts with prefix.
+    def subscribe(self, prefix):
+        sub = self.server.add_subscription(self.request, prefix)
+        try:
+            while (not sub.closed) and (self.server.serving):
+                try:
+                    data = sub.events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self.request.sendall(data)
+        except OSError:
+            pass
+        finally:
+            self.server.remove_subscription(sub)
+            if (sub.dropped):
+                logging.getLogger("Interactor").warn(
+                    "Subscriber {} dropped {} events.".format(
+                        self.client_address, sub.dropped))
+
+
+class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+
+    # size of the send buffer per subscriber and what happens if it is full;
+    # "drop" discards the new event, "disconnect" closes the connection.
+    subscriber_buffer = 64
+    subscriber_policy = "drop"
+
+    # received codes within this time of an identical one count as repeat.
+    repeat_interval = 0.25
+
+    def setManager(self, manager):
+        self.mcu_manager_ = manager
+        self.serving = True
+        self.subscriptions = set()
+        self.subscription_lock = threading.Lock()
+        self.last_event = (None, 0.0, 0)  # code, timestamp, repeat count
+        manager.add_listener(self.publish)
+
+    def add_subscription(self, request, prefix):
+        sub = Subscription(request, prefix, self.subscriber_buffer,
+                           self.subscriber_policy)
+        with self.subscription_lock:
+            self.subscriptions.add(sub)
+        return sub
+
+    def remove_subscription(self, sub):
+        with self.subscription_lock:
+            self.subscriptions.discard(sub)
+
+    # Listener for the manager, hands the event to all subscribers.
+    def publish(self, interactor, ir_code, ir_name):
+        now = interactor.received_time or time.time()
+        code = ir_code.tuple()
+        last_code, last_time, repeat = self.last_event
+        repeat = repeat + 1 if (code == last_code) and (
+            now - last_time < self.repeat_interval) else 0
+        self.last_event = (code, now, repeat)
+
+        if (not self.subscriptions):
+            return
+        event = {"name": ir_name, "timestamp": now, "repeat": repeat,
+                 "code": {"type": code[0], "bits": code[1],
+                          "value": code[2]}}
+        data = bytes(json.dumps(event) + "\n", 'ascii')
+        with self.subscription_lock:
+            subscriptions = list(self.subscriptions)
+        for sub in subscriptions:
+            sub.offer(ir_name, data)
+
+    def shutdown(self):
+        self.serving = False
+        super().shutdown()
+
+
+# Puts the records on the queue as they are; the message is formatted by the
+# QueueListener's thread instead of the thread that logs it.
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+def start(conf):
+    import argparse  # only needed here, keep importing the module cheap.
+
+    parser = argparse.ArgumentParser(description="Control MCU at serial port.")
+    parser.add_argument('--serial', '-s', help="The serial port to use.",
+                        default="/dev/ttyUSB0")
+    parser.add_argument('--baudrate', '-r', help="The badurate for the port.",
+                        default=9600, type=int)
+    parser.add_argument('--link-baudrate', help="Negotiate this baudrate "
+                        "with the firmware after connecting.", default=None,
+                        type=int)
+    parser.add_argument('--protocol', help="Negotiate this protocol version "
+                        "with the firmware after connecting.", default=1,
+                        type=int, choices=[1, 2])
+    parser.add_argument('--verbose', '-v', help="Print all communication.",
+                        action="store_true", default=False)
+    parser.add_argument('--serial-process', help="Handle the serial port in a"
+                        " separate process.", action="store_true",
+                        default=False)
+
+    parser.add_argument('--tcpport', '-p', help="The port used for the tcp"
+                        " socket.",
+                        default=9999)
+    parser.add_argument('--tcphost', '-b', help="The host/ip on which to bind"
+                        " the tcp socket receiving the IR commands.",
+                        default="127.0.0.1")
+    parser.add_argument('--queue-size', help="Maximum number of messages in"
+                        " the send and receive queues, 0 is unbounded.",
+                        default=256, type=int)
+    parser.add_argument('--rx-policy', help="What to do with received "
+                        "messages if the queue is full.",
+                        choices=MessageQueue.policies, default="drop_oldest")
+    parser.add_argument('--tx-policy', help="What to do with messages to be "
+                        "sent if the queue is full.",
+                        choices=MessageQueue.policies, default="drop_newest")
+    parser.add_argument('--queue-timeout', help="Milliseconds to wait for "
+                        "space in a full queue with the block policy, after "
+                        "which the message is dropped.", default=1000.0,
+                        type=float)
+    parser.add_argument('--max-age', help="Discard messages that are older "
+                        "than this many milliseconds.", default=None,
+                        type=float)
+    parser.add_argument('--coalesce', help="Combine identical IR codes sent "
+                        "within this many milliseconds into one repeat "
+                        "command.", default=None, type=float)
+    parser.add_argument('--subscriber-buffer', help="Number of events "
+                        "buffered per TCP subscriber.", default=64, type=int)
+    parser.add_argument('--subscriber-policy', help="What to do when the "
+                        "buffer of a TCP subscriber is full.",
+                        choices=["drop", "disconnect"], default="drop")
+    parser.add_argument('--capture', help="Append all received messages to "
+                        "this capture file.", default=None)
+    parser.add_argument('--bus', help="Publish received IR codes on the "
+                        "shared memory event bus with this name.",
+                        default=None)
+    parser.add_argument('--gateway', help="Publish received IR codes to "
+                        "this UDP multicast group and send the codes that "
+                        "are requested in it, for example 239.255.73.82.",
+                        default=None)
+    parser.add_argument('--gateway-port', help="The UDP port of the gateway.",
+                        default=7382, type=int)
+    parser.add_argument('--learn', help="Collect the codes that are not "
+                        "known and write these to this code file when "
+                        "stopping.", default=None)
+    parser.add_argument('--learn-prefix', help="Prefix for the learned "
+                        "codes.", default="learned_")
+    parser.add_argument('--learn-min-count', help="Number of times a code "
+                        "must be received to be learned.", default=3,
+                        type=int)
+    parser.add_argument('--heartbeat', help="Request the status of the MCU "
+                        "every this many seconds, to detect stalls and "
+                        "timestamp received codes accurately.",
+                        type=float, default=None)
+
+    # parse the arguments.
+    args = parser.parse_args()
+
+    # start the serial interface
+    max_age = None if args.max_age is None else args.max_age / 1000.0
+    queue_timeout = args.queue_timeout / 1000.0
+    options = {"rx_queue": MessageQueue(args.queue_size, args.rx_policy,
+                                        max_age, queue_timeout),
+               "tx_queue": MessageQueue(args.queue_size, args.tx_policy,
+                                        max_age, queue_timeout)}
+    if (args.coalesce is not None):
+        options["coalesce_window"] = args.coalesce / 1000.0
+    if (args.serial_process):
+        a = ProcessSerialInterface(packet_size=message.PACKET_SIZE, **options)
+    else:
+        a = SerialInterface(packet_size=message.PACKET_SIZE, **options)
+    a.connect(serial_port=args.serial, baudrate=args.baudrate,
+              link_baudrate=args.link_baudrate, link_protocol=args.protocol)
+    a.start()  # start the interface
+
+    # pretty elaborate logging...
+    logger_interface = logging.getLogger("ir_control.interface")
+    logger_IR_control = logging.getLogger("IR_Control")
+    logger_interactor = logging.getLogger("Interactor")
+    if (args.verbose):
+        logger_interface.setLevel(logging.DEBUG)
+        logger_IR_control.setLevel(logging.DEBUG)
+        logger_interactor.setLevel(logging.DEBUG)
+    else:
+        logger_interactor.setLevel(logging.WARN)
+        logger_interface.setLevel(logging.WARN)
+
+    # the records are formatted and written by a separate thread, such that
+    # a slow terminal does not hold up the serial port or the actions.
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(name)s - %(asctime)s - %(levelname)s'
+                                  ' - %(message)s')
+    ch.setFormatter(formatter)
+    log_listener = logging.handlers.QueueListener(queue.Queue(), ch)
+    qh = LogQueueHandler(log_listener.queue)
+    logger_interface.addHandler(qh)
+    logger_IR_control.addHandler(qh)
+    logger_interactor.addHandler(qh)
+    log_listener.start()
+
+    # start the Interactor 'glue' object.
+    m = Interactor(a, serial_port=args.serial, baudrate=args.baudrate)
+    m.load_config(conf)
+
+    if (args.capture):
+        from .capture import CaptureWriter
+        m.capture = CaptureWriter(args.capture)
+
+    if (args.heartbeat):
+        from .heartbeat import Heartbeat
+        m.heartbeat = Heartbeat(args.heartbeat)
+
+    # publish received codes to local processes through shared memory.
+    bus = None
+    if (args.bus):
+        from .bus import EventBus
+        bus = EventBus(args.bus)
+        m.add_listener(bus.listener)
+
+    # collect the codes that are not known.
+    learner = None
+    if (args.learn):
+        from .learn import Learner
+        learner = Learner(min_count=args.learn_min_count)
+        m.add_listener(learner.listener)
+
+    # publish received codes to other hosts and send the codes they request.
+    gateway = None
+    if (args.gateway):
+        from .gateway import Gateway
+        gateway = Gateway(args.gateway, args.gateway_port)
+        m.add_listener(gateway.listener)
+        gateway.serve(m)
+
+    # This is only for the TCP server to facilitate sending IR codes from the
+    # terminal easily.
+    server = ThreadedTCPServer((args.tcphost, args.tcpport), TCPCommandHandler)
+    server.subscriber_buffer = args.subscriber_buffer
+    server.subscriber_policy = args.subscriber_policy
+    server.setManager(m)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    # loop the IR_Control object such that the correct actions are performed
+    try:
+        m.loop()
+    except KeyboardInterrupt as e:
+        m.stop()
+        a.stop()
+        logger_IR_control.error("Received interrupt signal, stopping.")
+    finally:
+        if (bus is not None):
+            bus.close()
+        if (gateway is not None):
+            gateway.close()
+        if (learner is not None):
+            count = learner.write(args.learn, args.learn_prefix)
+            logger_IR_control.error("Wrote {} learned codes to {}.".format(
+                                    count, args.learn))
+        if (m.capture is not None):
+            m.capture.close()
+        log_listener.stop()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Host side decoder for raw IR timings, such that protocols can be added
+    without reflashing the firmware. This requires numpy.
+
+    Captures are arrays of mark and space durations in microseconds, starting
+    with a mark, as provided by `raw.RawAssembler`. The pulse distance and
+    pulse width protocols (NEC, SAMSUNG, LG, JVC, SONY) are decoded with
+    thresholds on whole arrays; `decode_many` stacks the captures of equal
+    length into one matrix, such that a large number of captures is decoded
+    with a handful of numpy operations. The bi-phase protocols (RC5, RC6) are
+    expanded into a signal level per half bit and sampled.
+
+    The results are `message.IR` tuples, like those the firmware sends, and
+    the value is formed in the same way as the IRremote library does, the
+    first bit received being the most significant.
+
+    Decoding a file with one capture per line, as printed by `raw_received`:
+        python3 -m ir_control.decoder captures.txt
+"""
+
+from .message import IR, IR_type
+
+from collections import namedtuple
+import numpy as np
+
+# relative tolerance on durations, and the minimum absolute tolerance in us,
+# the latter accounts for the 50 us resolution of the captures.
+TOLERANCE = 0.3
+MIN_TOLERANCE = 150
+
+# Protocols that encode the bits in the length of the space after each mark.
+PulseDistance = namedtuple("PulseDistance", ["type", "header_mark",
+                                             "header_space", "bit_mark",
+                                             "zero_space", "one_space",
+                                             "bits"])
+
+# Protocols that encode the bits in the length of the marks (SONY).
+PulseWidth = namedtuple("PulseWidth", ["type", "header_mark", "header_space",
+                                       "zero_mark", "one_mark", "bit_space",
+                                       "bits"])
+
+PULSE_DISTANCE = [
+    PulseDistance(IR_type.NEC, 9000, 4500, 560, 560, 1690, 32),
+    PulseDistance(IR_type.SAMSUNG, 5000, 5000, 560, 560, 1600, 32),
+    PulseDistance(IR_type.LG, 8000, 4000, 600, 550, 1600, 28),
+    PulseDistance(IR_type.JVC, 8400, 4200, 600, 550, 1600, 16),
+]
+
+PULSE_WIDTH = [
+    PulseWidth(IR_type.SONY, 2400, 600, 600, 1200, 600, bits)
+    for bits in (12, 15, 20)
+]
+
+# NEC repeat code, reported by IRremote as value 0xFFFFFFFF with 0 bits.
+NEC_REPEAT = (9000, 2250, 560)
+
+RC5_T = 889
+RC6_T = 444
+RC6_HEADER = (2666, 889)
+
+
+def _match(values, expected):
+    # elementwise comparison against an expected duration.
+    return np.abs(values - expected) <= max(expected * TOLERANCE,
+                                            MIN_TOLERANCE)
+
+
+def _to_values(bits):
+    # converts a matrix of bits, first bit most significant, to integers.
+    weights = np.left_shift(np.uint64(1), np.arange(bits.shape[1] - 1, -1, -1,
+                                                    dtype=np.uint64))
+    return (bits.astype(np.uint64) * weights).sum(axis=1)
+
+
+def _decode_pulse_distance(captures, spec):
+    # captures is a matrix with one capture per row, of length 2n + 3.
+    ok = _match(captures[:, 0], spec.header_mark) & \
+        _match(captures[:, 1], spec.header_space)
+    marks = captures[:, 2::2]
+    spaces = captures[:, 3::2]
+    ok &= _match(marks, spec.bit_mark).all(axis=1)
+    one = _match(spaces, spec.one_space)
+    ok &= (one | _match(spaces, spec.zero_space)).all(axis=1)
+    return ok, _to_values(one)
+
+
+def _decode_pulse_width(captures, spec):
+    # captures is a matrix with one capture per row, of length 2n + 1.
+    ok = _match(captures[:, 0], spec.header_mark) & \
+        _match(captures[:, 1], spec.header_space)
+    marks = captures[:, 2::2]
+    spaces = captures[:, 3::2]
+    ok &= _match(spaces, spec.bit_space).all(axis=1)
+    one = _match(marks, spec.one_mark)
+    ok &= (one | _match(marks, spec.zero_mark)).all(axis=1)
+    return ok, _to_values(one)
+
+
+def _decode_matrix(captures):
+    # decodes captures of equal length, returns a list with IR or None.
+    n = captures.shape[0]
+    length = captures.shape[1]
+    results = [None] * n
+
+    if (length == len(NEC_REPEAT)):
+        ok = np.ones(n, dtype=bool)
+        for column, expected in enumerate(NEC_REPEAT):
+            ok &= _match(captures[:, column], expected)
+        for i in np.flatnonzero(ok):
+            results[i] = IR(type=IR_type.NEC, bits=0, value=0xFFFFFFFF)
+        return results
+
+    candidates = [(spec, _decode_pulse_distance) for spec in PULSE_DISTANCE
+                  if length == 2 * spec.bits + 3]
+    candidates += [(spec, _decode_pulse_width) for spec in PULSE_WIDTH
+                   if length == 2 * spec.bits + 1]
+    for spec, decode in candidates:
+        ok, values = decode(captures, spec)
+        for i in np.flatnonzero(ok):
+            if (results[i] is None):
+                results[i] = IR(type=spec.type, bits=spec.bits,
+                                value=int(values[i]))
+    return results
+
+
+def _levels(durations, unit, max_units):
+    # expands durations into one signal level (1 is mark) per unit of time.
+    units = np.rint(durations / unit).astype(np.int64)
+    if (units.min() < 1) or (units.max() > max_units) or not (
+            np.abs(durations - units * unit) <= unit * 0.5).all():
+        return None
+    levels = np.zeros(len(durations), dtype=np.uint8)
+    levels[0::2] = 1
+    return np.repeat(levels, units)
+
+
+def decode_rc5(durations):
+    """
+        Decodes an RC5 capture, the bits after the two start bits form the
+        value. Returns an `IR` or None.
+    """
+    levels = _levels(durations, RC5_T, 2)
+    if (levels is None):
+        return None
+    # the first half of the first start bit is a space, which is not in the
+    # capture, as is the space at the end of a last bit that is zero.
+    levels = np.concatenate(([0], levels))
+    if (len(levels) % 2):
+        levels = np.concatenate((levels, [0]))
+    halves = levels.reshape(-1, 2)
+    # every bit has a transition, a one is a space followed by a mark.
+    if (halves[:, 0] == halves[:, 1]).any() or (len(halves) < 3):
+        return None
+    bits = halves[2:, 1].reshape(1, -1)
+    return IR(type=IR_type.RC5, bits=bits.shape[1],
+              value=int(_to_values(bits)[0]))
+
+
+def decode_rc6(durations):
+    """
+        Decodes an RC6 capture, the mode bits, trailer bit and the data form
+        the value. Returns an `IR` or None.
+    """
+    if (len(durations) < 4) or not (_match(durations[0], RC6_HEADER[0]) and
+                                    _match(durations[1], RC6_HEADER[1])):
+        return None
+    levels = _levels(durations[2:], RC6_T, 3)
+    if (levels is None):
+        return None
+    # start bit, a one is a mark followed by a space.
+    if (len(levels) < 2) or (levels[0] != 1) or (levels[1] != 0):
+        return None
+    bits = []
+    position = 2
+    while (position < len(levels)):
+        width = 2 if len(bits) == 3 else 1  # the trailer bit is twice as long
+        first = levels[position:position + width]
+        second = levels[position + width:position + 2 * width]
+        if (len(second) < width):
+            # the last half is a space that is not part of the capture.
+            second = np.zeros(width, dtype=np.uint8)
+        if (first != first[0]).any() or (second != 1 - first[0]).any():
+            return None
+        bits.append(first[0])
+        position += 2 * width
+    if (len(bits) < 5):
+        return None
+    bits = np.array(bits).reshape(1, -1)
+    return IR(type=IR_type.RC6, bits=bits.shape[1],
+              value=int(_to_values(bits)[0]))
+
+
+def decode_many(captures):
+    """
+        Decodes a batch of captures.
+
+        :param captures: The captures, each is a sequence of durations in
+            microseconds starting with a mark.
+        :type captures: iterable of sequences or arrays.
+        :returns: list holding an `IR` or None for each capture.
+    """
+    captures = [np.asarray(c, dtype=np.float64) for c in captures]
+    results = [None] * len(captures)
+
+    # stack the captures with the same length, decode these at once.
+    by_length = {}
+    for index, capture in enumerate(captures):
+        by_length.setdefault(len(capture), []).append(index)
+    for length, indices in by_length.items():
+        if (length == 0):
+            continue
+        matrix = np.stack([captures[i] for i in indices])
+        for i, result in zip(indices, _decode_matrix(matrix)):
+            results[i] = result
+
+    # the bi-phase protocols do not have a fixed length.
+    for index, capture in enumerate(captures):
+        if (results[index] is None) and (len(capture)):
+            results[index] = decode_rc6(capture) or decode_rc5(capture)
+    return results
+
+
+def decode(durations):
+    """
+        Decodes a single capture, returns an `IR` or None.
+    """
+    return decode_many([durations])[0]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    captures = []
+    with open(sys.argv[1], 'r') as f:
+        for line in f:
+            line = line.split(":")[-1].split()
+            if (line):
+                captures.append([int(d) for d in line])
+    start = time.time()
+    results = decode_many(captures)
+    duration = time.time() - start
+    for result in results:
+        print(result.config_print() if result else "-")
+    sys.stderr.write("Decoded {} of {} captures in {:.3f} s.\n".format(
+        sum(1 for r in results if r), len(results), duration))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Version 2 of the serial protocol. Instead of fixed 16 byte messages, each
+    frame is a variable length payload followed by a CRC-16, COBS encoded and
+    terminated by a zero byte. This makes the stream self synchronising and
+    corrupted frames are detected and discarded instead of being decoded as
+    a wrong IR code.
+
+    The payload starts with the message type as one byte. For action_IR_send
+    it is followed by one or more 6 byte IR specifications, such that several
+    codes can be carried by one frame. For action_IR_received these are 10
+    bytes, the specification followed by the uptime of the MCU; a payload
+    that is not a whole number of records is discarded as corrupted. For
+    the other message types it is followed by the body of the message with
+    the trailing zero bytes removed, these are restored when decoding.
+
+    Version 2 is negotiated with the set_protocol message, which is always
+    sent as a version 1 message.
+"""
+
+from . import message
+
+import ctypes
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+
+# Maximum size of a payload, this matches the buffer in the firmware.
+MAX_PAYLOAD = 64
+
+_BODY_SIZE = message.PACKET_SIZE - 2
+_IR_SIZE = ctypes.sizeof(message.MsgIRSpecification)
+
+# message types that carry a list of IR specifications, and their size.
+_IR_TYPES = {message.msg_type.action_IR_send: _IR_SIZE,
+             message.msg_type.action_IR_received:
+                 ctypes.sizeof(message.MsgIRReceived)}
+
+# maximum number of IR specifications in one frame.
+MAX_IR_PER_FRAME = (MAX_PAYLOAD - 1 - 2) // _IR_SIZE
+
+
+def _crc16_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+_CRC_TABLE = _crc16_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """
+        CRC-16/CCITT-FALSE of data, as computed by the firmware.
+    """
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC_TABLE[(crc >> 8) ^ b]
+    return crc
+
+
+def cobs_encode(data):
+    """
+        Consistent overhead byte stuffing, the result has no zero bytes.
+    """
+    out = bytearray()
+    for block in bytes(data).split(b"\x00"):
+        # blocks longer than 254 bytes are split with a 0xFF code.
+        while (len(block) >= 254):
+            out.append(0xFF)
+            out += block[:254]
+            block = block[254:]
+        out.append(len(block) + 1)
+        out += block
+    return bytes(out)
+
+
+def cobs_decode(data):
+    """
+        Reverses `cobs_encode`, raises ValueError on malformed input.
+    """
+    out = bytearray()
+    i = 0
+    while (i < len(data)):
+        code = data[i]
+        if (code == 0) or (i + code > len(data)):
+            raise ValueError("Malformed COBS block.")
+        out += data[i + 1:i + code]
+        i += code
+        if (code < 0xFF) and (i < len(data)):
+            out.append(0)
+    return bytes(out)
+
+
+def encode_frame(payload):
+    """
+        Appends the CRC to the payload, COBS encodes it and adds the
+        delimiter.
+    """
+    crc = crc16(payload)
+    return cobs_encode(bytes(payload) + bytes([crc & 0xFF, crc >> 8])) + \
+        b"\x00"
+
+
+def encode_messages(msgs):
+    """
+        Encodes messages into as few frames as possible, consecutive messages
+        with IR specifications of the same type are combined into one frame.
+
+        :param msgs: The messages to be sent.
+        :type msgs: list of `message.Msg`
+        :returns: bytes holding the frames.
+    """
+    out = bytearray()
+    i = 0
+    while (i < len(msgs)):
+        msg = msgs[i]
+        payload = bytearray([msg.msg_type])
+        if (msg.msg_type in _IR_TYPES):
+            size = _IR_TYPES[msg.msg_type]
+            count = 0
+            while (i < len(msgs)) and (msgs[i].msg_type == msg.msg_type) and (
+                    count < (MAX_PAYLOAD - 1 - 2) // size):
+                payload += bytes(msgs[i].raw)[:size]
+                count += 1
+                i += 1
+        else:
+            payload += bytes(msg.raw).rstrip(b"\x00")
+            i += 1
+        out += encode_frame(payload)
+    return bytes(out)
+
+
+def decode_payload(payload):
+    """
+        Converts a payload back into messages.
+
+        :returns: list of `message.Msg`
+    """
+    msg_type = payload[0]
+    body = payload[1:]
+    if (msg_type in _IR_TYPES):
+        size = _IR_TYPES[msg_type]
+        if (not body) or (len(body) % size):
+            raise ValueError("Payload is not a whole number of records.")
+        return [message.Msg.read(bytes([msg_type, 0]) +
+                                 body[offset:offset + size])
+                for offset in range(0, len(body) - size + 1, size)]
+    if (len(body) > _BODY_SIZE):
+        raise ValueError("Payload too long for message type.")
+    return [message.Msg.read(bytes([msg_type, 0]) + bytes(body))]
+
+
+class FrameDecoder:
+    """
+        Splits a byte stream into frames and decodes these into messages.
+        Frames that are malformed or of which the CRC does not match are
+        discarded and counted in `errors`.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        """
+            Adds received bytes, returns the complete messages.
+
+            :returns: list of `message.Msg`
+        """
+        self.buffer += data
+        msgs = []
+        while (True):
+            end = self.buffer.find(b"\x00")
+            if (end < 0):
+                break
+            frame = bytes(self.buffer[:end])
+            del self.buffer[:end + 1]
+            if (not frame):
+                continue  # consecutive delimiters are used to resynchronise.
+            try:
+                decoded = cobs_decode(frame)
+                if (len(decoded) < 3) or (crc16(decoded[:-2]) != (
+                        decoded[-2] | (decoded[-1] << 8))):
+                    raise ValueError("CRC mismatch.")
+                msgs.extend(decode_payload(decoded[:-2]))
+            except ValueError:
+                self.errors += 1
+        # without a delimiter the buffer can not grow beyond a frame.
+        if (len(self.buffer) > 2 * MAX_PAYLOAD):
+            del self.buffer[:]
+            self.errors += 1
+        return msgs
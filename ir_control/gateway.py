@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Gateway to share received IR codes with other hosts over UDP multicast,
+    and to accept requests from them to send IR codes.
+
+    Every datagram holds one event; a header with the node that sent it and
+    its sequence number, followed by the timestamp, the code and the name.
+    Gaps in the sequence numbers of a node are counted as lost. A datagram
+    that was already received is ignored, as is the same code from another
+    node within `dedup_window` seconds, this happens if several hosts with a
+    receiver see the same remote.
+
+    Publishing and accepting send requests, this is done by `start()` if
+    `--gateway GROUP` is passed:
+        gateway = Gateway(group)
+        interactor.add_listener(gateway.listener)
+        gateway.serve(interactor)
+
+    On a host without a receiver, to perform the actions of its configuration
+    for the codes received by the other hosts:
+        interactor = Interactor(None, None, None)
+        interactor.load_config(conf)
+        Gateway(group).serve(interactor, perform=True).join()
+
+    Requesting a send from any host:
+        Gateway(group).request_send("samsung_tv_standby")
+"""
+
+from . import message
+
+from collections import namedtuple
+import itertools
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GROUP = "239.255.73.82"
+DEFAULT_PORT = 7382
+
+# Header: magic, version, kind, node, sequence.
+_HEADER = struct.Struct("<2sBBII")
+_MAGIC = b"IR"
+_VERSION = 1
+
+# Body: timestamp, type, bits, value, followed by the name.
+_BODY = struct.Struct("<dHBI")
+NAME_LENGTH = 48
+
+# The kinds of datagrams.
+KIND_EVENT = 1  # a received IR code.
+KIND_SEND = 2  # a request to send an IR code, by name if it is set.
+
+# A datagram, code is a `message.IR` instance, name is the ir_name or an
+# empty string if the code is not known.
+Event = namedtuple("Event", ["kind", "node", "seq", "timestamp", "name",
+                             "code"])
+
+
+class Gateway:
+    """
+        :param group: The multicast group.
+        :type group: str
+        :param port: The UDP port.
+        :type port: int
+        :param ttl: The number of hops datagrams may travel.
+        :type ttl: int
+        :param dedup_window: Seconds in which the same code from another node
+            is considered a duplicate.
+        :type dedup_window: float
+    """
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT, ttl=1,
+                 dedup_window=0.05):
+        self.group = group
+        self.port = port
+        self.dedup_window = dedup_window
+        self.node = int.from_bytes(os.urandom(4), "little")
+        self.counter = itertools.count(1)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                  socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if (hasattr(socket, "SO_REUSEPORT")):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(("", port))
+        membership = socket.inet_aton(group) + socket.inet_aton("0.0.0.0")
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                             membership)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+        self.peers = {}  # node: last sequence number received.
+        self.recent = {}  # code: (time of receipt, node).
+        self.lost = 0
+        self.duplicates = 0
+        self.running = False
+
+    def _send(self, kind, ir_code, ir_name, timestamp):
+        irtype, bits, value = ir_code.tuple()
+        name = (ir_name or "").encode("utf-8")[:NAME_LENGTH]
+        data = _HEADER.pack(_MAGIC, _VERSION, kind, self.node,
+                            next(self.counter)) + \
+            _BODY.pack(timestamp, irtype, bits, value) + name
+        try:
+            self.sock.sendto(data, (self.group, self.port))
+        except OSError as e:
+            logger.warning("Sending to %s failed: %s", self.group, e)
+
+    def publish(self, ir_code, ir_name=None, timestamp=None):
+        """
+            Sends a received code to the group.
+
+            :param ir_code: The received code.
+            :type ir_code: `message.IR`
+            :param ir_name: The name of the code, if known.
+            :type ir_name: str
+            :param timestamp: Time of receipt, defaults to `time.time()`.
+            :type timestamp: float
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        self._send(KIND_EVENT, ir_code, ir_name, timestamp)
+
+    # Listener signature, such that it can be passed to add_listener.
+    def listener(self, interactor, ir_code, ir_name):
+        self.publish(ir_code, ir_name, interactor.received_time)
+
+    def request_send(self, ir_name=None, ir_code=None):
+        """
+            Requests the nodes that serve the group to send a code, by name
+            or by the code itself.
+        """
+        if (ir_code is None):
+            ir_code = message.IR(type=0, bits=0, value=0)
+        self._send(KIND_SEND, ir_code, ir_name, time.time())
+
+    def _parse(self, data, now):
+        if (len(data) < _HEADER.size + _BODY.size):
+            return None
+        magic, version, kind, node, seq = _HEADER.unpack_from(data, 0)
+        if (magic != _MAGIC) or (version != _VERSION) or (
+                node == self.node):
+            return None
+
+        last = self.peers.get(node)
+        if (last is not None):
+            if (seq <= last):
+                self.duplicates += 1
+                return None
+            self.lost += seq - last - 1
+        self.peers[node] = seq
+
+        timestamp, irtype, bits, value = _BODY.unpack_from(data,
+                                                           _HEADER.size)
+        code = message.IR(type=irtype, bits=bits, value=value)
+        if (kind == KIND_EVENT):
+            # several nodes may have received the same code.
+            key = code.tuple()
+            previous = self.recent.get(key)
+            if (previous is not None) and (previous[1] != node) and (
+                    now - previous[0] < self.dedup_window):
+                self.duplicates += 1
+                return None
+            if (len(self.recent) > 1024):
+                self.recent = dict((k, v) for k, v in self.recent.items()
+                                   if now - v[0] < self.dedup_window)
+            self.recent[key] = (now, node)
+        name = data[_HEADER.size + _BODY.size:]
+        return Event(kind, node, seq, timestamp,
+                     name.decode("utf-8", "replace"), code)
+
+    def receive(self, timeout=None):
+        """
+            Waits for a datagram from another node.
+
+            :param timeout: Maximum time to wait in seconds, None waits
+                forever.
+            :type timeout: float
+            :returns: An `Event`, or None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while (True):
+            remaining = None if deadline is None else \
+                max(0, deadline - time.monotonic())
+            self.sock.settimeout(remaining)
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except socket.timeout:
+                return None
+            event = self._parse(data, time.monotonic())
+            if (event is not None):
+                return event
+
+    def serve(self, interactor, perform=False):
+        """
+            Starts a thread that sends the codes requested by other nodes with
+            the interactor.
+
+            :param interactor: The `Interactor` to send codes with.
+            :param perform: Also pass the codes received by other nodes to
+                `interactor.ir_received`, such that its actions are performed.
+                This should only be used if the interactor is not looping.
+            :type perform: bool
+            :returns: The thread.
+        """
+        self.running = True
+        thread = threading.Thread(target=self._serve,
+                                  args=(interactor, perform))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _serve(self, interactor, perform):
+        while (self.running):
+            try:
+                event = self.receive(0.5)
+            except OSError:
+                break  # closed.
+            if (event is None):
+                continue
+            if (event.kind == KIND_SEND):
+                if (event.name):
+                    interactor.send_ir_by_name(event.name)
+                else:
+                    interactor.send_ir(event.code)
+            elif (event.kind == KIND_EVENT) and (perform):
+                interactor.ir_received(event.code)
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    # Print the events in a group, or request a send.
+    import argparse
+    parser = argparse.ArgumentParser(description="IR_Control gateway.")
+    parser.add_argument("--group", default=DEFAULT_GROUP)
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int)
+    parser.add_argument("--send", default=None,
+                        help="Request the nodes to send this ir_name.")
+    args = parser.parse_args()
+
+    gateway = Gateway(args.group, args.port)
+    if (args.send):
+        gateway.request_send(args.send)
+        gateway.close()
+        raise SystemExit(0)
+    try:
+        while (True):
+            event = gateway.receive()
+            print("{:08X} {} {:.3f} {} {} {}".format(
+                  event.node, event.seq, event.timestamp,
+                  "send" if event.kind == KIND_SEND else "event",
+                  event.name, event.code.config_print()))
+            if (gateway.lost):
+                print("Lost {} datagrams.".format(gateway.lost))
+                gateway.lost = 0
+    except KeyboardInterrupt:
+        pass
+    gateway.close()
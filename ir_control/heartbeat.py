@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Monitors whether the MCU is alive by sending get_status at a fixed
+    interval. The round trip times of the replies are kept, and the uptime in
+    the replies is used to fit a linear model between the clock of the MCU
+    and that of the host, with an offset and a drift.
+
+    The firmware stamps every received IR code with its uptime, the model
+    converts this into the host time at which the code was actually received,
+    independent of any delays in the serial port or the queues.
+
+    If no reply arrives within one interval after the MCU replied before, it
+    is considered stalled.
+"""
+
+from . import message
+
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# maximum drift of the MCU's clock, ceramic resonators are within 0.5%.
+MAX_DRIFT = 0.01
+
+
+def percentile(values, p):
+    """
+        Returns the p-th percentile of the values, by the nearest rank.
+    """
+    if (not values):
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 *
+                                                   (len(ordered) - 1))))]
+
+
+class Heartbeat:
+    """
+        :param interval: Time in seconds between the get_status requests.
+        :type interval: float
+        :param window: Number of replies used for the statistics and the
+            clock model.
+        :type window: int
+    """
+    def __init__(self, interval=1.0, window=64):
+        self.interval = interval
+        self.rtts = collections.deque(maxlen=window)
+        self.samples = collections.deque(maxlen=window)
+        self.stalls = 0
+        self.lost = 0
+        self.reset()
+
+    def reset(self):
+        """
+            Forgets the clock model, used when the MCU was reset.
+        """
+        self.samples.clear()
+        self.sent_at = None
+        self.next_at = 0.0
+        self.stalled = False
+        self.model = None  # (mcu time, host time, slope) of the fit.
+
+    def poll(self, now):
+        """
+            Checks for a stall and returns a get_status message if one is due.
+
+            :param now: The current `time.monotonic()`.
+            :returns: `message.Msg` to be sent, or None.
+        """
+        if (self.sent_at is not None) and (now - self.sent_at > self.interval):
+            self.lost += 1
+            self.sent_at = None
+            if (self.samples) and (not self.stalled):
+                self.stalled = True
+                self.stalls += 1
+                logger.error("No status reply within %.3f s, MCU stalled.",
+                             self.interval)
+        if (self.sent_at is None) and (now >= self.next_at):
+            self.sent_at = now
+            self.next_at = now + self.interval
+            msg = message.Msg()
+            msg.msg_type = msg.type.get_status
+            return msg
+        return None
+
+    def reply(self, msg, now):
+        """
+            Processes a get_status reply.
+
+            :param msg: The reply.
+            :type msg: `message.Msg`
+            :param now: The `time.monotonic()` at which it was received.
+        """
+        if (self.sent_at is None):
+            return  # not requested by us, or too late.
+        rtt = now - self.sent_at
+        # the MCU replied halfway the round trip, on average.
+        host = self.sent_at + rtt / 2.0
+        self.sent_at = None
+        if (self.stalled):
+            self.stalled = False
+            logger.warning("MCU responding again.")
+
+        uptime = msg.status.uptime / 1000.0
+        if (self.samples) and (uptime < self.samples[-1][0]):
+            logger.info("MCU uptime went backwards, it was reset.")
+            self.samples.clear()
+        self.rtts.append(rtt)
+        self.samples.append((uptime, host, rtt))
+        self._fit()
+
+    def _fit(self):
+        # the replies with a long round trip time are the least accurate, use
+        # only those near the fastest one.
+        fastest = min(s[2] for s in self.samples)
+        samples = [s for s in self.samples if s[2] <= 2 * fastest]
+        mcu_mean = sum(s[0] for s in samples) / len(samples)
+        host_mean = sum(s[1] for s in samples) / len(samples)
+        variance = sum((s[0] - mcu_mean) ** 2 for s in samples)
+        slope = 1.0
+        if (variance > 0):
+            slope = sum((s[0] - mcu_mean) * (s[1] - host_mean)
+                        for s in samples) / variance
+            # few samples close together give a poor estimate, the clock of
+            # the MCU is never this far off.
+            slope = min(max(slope, 1.0 - MAX_DRIFT), 1.0 + MAX_DRIFT)
+        self.model = (mcu_mean, host_mean, slope)
+
+    def to_host(self, uptime):
+        """
+            Converts the uptime of the MCU in milliseconds to the host's
+            `time.monotonic()`, None if there is no model yet.
+        """
+        if (self.model is None):
+            return None
+        mcu_mean, host_mean, slope = self.model
+        return host_mean + slope * (uptime / 1000.0 - mcu_mean)
+
+    def stamp(self, uptime, now):
+        """
+            Returns the `time.time()` corresponding to the uptime of the MCU,
+            or now if it can not be converted.
+
+            :param uptime: The uptime in milliseconds, 0 if unknown.
+            :param now: The current `time.time()`.
+        """
+        host = self.to_host(uptime) if uptime else None
+        if (host is None):
+            return now
+        return min(now, host + (now - time.monotonic()))
+
+    def get_statistics(self):
+        rtts = list(self.rtts)
+        stats = {"rtt": {"p50": percentile(rtts, 50),
+                         "p90": percentile(rtts, 90),
+                         "p99": percentile(rtts, 99)},
+                 "stalled": self.stalled,
+                 "stalls": self.stalls,
+                 "lost": self.lost}
+        if (self.model is not None):
+            mcu_mean, host_mean, slope = self.model
+            stats["offset"] = host_mean - slope * mcu_mean
+            stats["drift_ppm"] = (slope - 1.0) * 1e6
+        return stats
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Imports remote definitions from external IR code libraries and writes them
+    as code files that `Configurator.load_codes` reads, one file per remote.
+
+    Two formats are understood:
+        - LIRC configuration files (lircd.conf) with space encoded remotes.
+          The protocol is determined from the flags and the header timings,
+          the pre_data and post_data are combined with the codes.
+        - CSV files, either with the columns name, protocol, bits and value,
+          or in the style of the IRDB with the columns functionname,
+          protocol, device, subdevice and function.
+
+    The files are parsed in a process pool. The remotes are then merged; a
+    remote that is identical to an earlier one is skipped, and codes that
+    occur in several remotes are reported as conflicts, as only the last one
+    loaded would be used by the `Configurator`. Within a remote the first
+    name of a code is kept, just like when a code file is loaded. Key names
+    that become equal when cleaned are numbered, such that no key is lost.
+
+    From the commandline:
+        python3 -m ir_control.importer -o codes/ lirc/remotes/*/*.conf
+"""
+
+from .message import IR, IR_type_id
+from .config import write_code_file
+
+from collections import namedtuple, OrderedDict
+import concurrent.futures
+import csv
+import os
+import re
+
+# A remote read from a file, codes is a dict of IR code: name.
+Remote = namedtuple("Remote", ["name", "source", "codes", "errors"])
+
+# header mark and space in microseconds for the space encoded protocols.
+_HEADERS = [("NEC", 9000, 4500),
+            ("SAMSUNG", 4500, 4500),
+            ("SONY", 2400, 600),
+            ("JVC", 8400, 4200),
+            ("LG", 8000, 4000)]
+
+
+def clean_name(name):
+    """
+        Converts a name into one that is valid in a code file.
+    """
+    # keep "Vol+" and "Vol-" apart.
+    name = re.sub(r"\+\s*$", " plus", re.sub(r"-\s*$", " minus", name))
+    name = re.sub(r"[^0-9a-z]+", "_", name.lower()).strip("_")
+    return name if name else "unnamed"
+
+
+def _unique_name(name, taken):
+    # Different keys can still clean to the same name, e.g. "Ch 1" and
+    # "ch-1", number them such that neither is lost.
+    unique, i = name, 2
+    while (unique in taken):
+        unique = "{}_{}".format(name, i)
+        i += 1
+    taken.add(unique)
+    return unique
+
+
+def _reverse_bits(value, bits):
+    return int("{:0{}b}".format(value, bits)[::-1], 2)
+
+
+def _lirc_protocol(fields):
+    flags = fields.get("flags", "").upper()
+    for proto in ("RC5", "RC6"):
+        if (proto in flags):
+            return proto
+    header = fields.get("header", "").split()
+    if (len(header) != 2):
+        return None
+    mark, space = int(header[0]), int(header[1])
+    for proto, proto_mark, proto_space in _HEADERS:
+        if (abs(mark - proto_mark) < proto_mark * 0.2) and (
+                abs(space - proto_space) < proto_space * 0.2):
+            return proto
+    return None
+
+
+def _lirc_remote(fields, codes, path):
+    errors = []
+    name = clean_name(fields.get("name", os.path.basename(path)))
+    if ("RAW_CODES" in fields.get("flags", "").upper()):
+        errors.append("Remote {} has raw codes, these are not imported."
+                      "".format(name))
+        return Remote(name, path, {}, errors)
+    proto = _lirc_protocol(fields)
+    if (proto is None):
+        errors.append("Remote {} has an unknown protocol.".format(name))
+        return Remote(name, path, {}, errors)
+
+    def number(key):
+        return int(fields.get(key, "0").split()[0], 0)
+    bits = number("bits")
+    pre_bits, pre_data = number("pre_data_bits"), number("pre_data")
+    post_bits, post_data = number("post_data_bits"), number("post_data")
+    total = pre_bits + bits + post_bits
+    if (total > 32):
+        errors.append("Remote {} has {} bits, at most 32 are supported."
+                      "".format(name, total))
+        return Remote(name, path, {}, errors)
+
+    result = {}
+    keys = {}
+    taken = set()
+    for key, value in codes:
+        value = (((pre_data << bits) | value) << post_bits) | post_data
+        if ("REVERSE" in fields.get("flags", "").upper()):
+            value = _reverse_bits(value, total)
+        code = IR(type=proto, bits=total, value=value)
+        key = clean_name(key)
+        if (code in keys):
+            if (keys[code] != key):
+                errors.append("Duplicate code for {} and {} in remote {}."
+                              "".format(keys[code], key, name))
+            continue
+        keys[code] = key
+        result[code] = _unique_name(key, taken)
+    return Remote(name, path, result, errors)
+
+
+def parse_lirc(path):
+    """
+        Reads the remotes from a LIRC configuration file.
+
+        :returns: list of `Remote` instances.
+    """
+    remotes = []
+    fields = {}
+    codes = []
+    section = None
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if (not line):
+                continue
+            entries = line.split()
+            keyword = entries[0].lower()
+            if (keyword == "begin") and (len(entries) > 1):
+                section = entries[1].lower()
+                if (section == "remote"):
+                    fields, codes = {}, []
+            elif (keyword == "end") and (len(entries) > 1):
+                if (entries[1].lower() == "remote"):
+                    remotes.append(_lirc_remote(fields, codes, path))
+                section = "remote"
+            elif (section == "remote") and (len(entries) > 1):
+                fields[keyword] = " ".join(entries[1:])
+            elif (section == "codes") and (len(entries) > 1):
+                try:
+                    codes.append((entries[0], int(entries[1], 0)))
+                except ValueError:
+                    pass
+            # raw_codes and other sections are ignored.
+    return remotes
+
+
+def _irdb_value(protocol, device, subdevice, function):
+    # Returns the type, bits and value as decoded by the IRremote library,
+    # which stores the bits in the order they are transmitted.
+    protocol = protocol.upper()
+    if (protocol.startswith("NEC")):
+        if (subdevice < 0):
+            subdevice = device ^ 0xFF
+        fields = [device, subdevice, function, function ^ 0xFF]
+        return ("NEC", 32, sum(_reverse_bits(f, 8) << (24 - 8 * i)
+                               for i, f in enumerate(fields)))
+    if (protocol == "SAMSUNG32"):
+        fields = [device, subdevice if subdevice >= 0 else device, function,
+                  function ^ 0xFF]
+        return ("SAMSUNG", 32, sum(_reverse_bits(f, 8) << (24 - 8 * i)
+                                   for i, f in enumerate(fields)))
+    if (protocol in ("SONY12", "SONY15", "SONY20")):
+        bits = int(protocol[4:])
+        value = function | (device << 7)
+        if (bits == 20):
+            value |= max(subdevice, 0) << 12
+        return ("SONY", bits, _reverse_bits(value, bits))
+    return None
+
+
+def parse_csv(path):
+    """
+        Reads the codes from a CSV file, the file is one remote.
+
+        :returns: list of `Remote` instances.
+    """
+    name = clean_name(os.path.splitext(os.path.basename(path))[0])
+    result = {}
+    keys = {}
+    taken = set()
+    errors = []
+    with open(path, 'r', newline='', errors='replace') as f:
+        reader = csv.DictReader(f)
+        for line_num, row in enumerate(reader, 2):
+            row = dict((k.strip().lower(), (v or "").strip())
+                       for k, v in row.items() if k)
+            try:
+                if ("functionname" in row):
+                    key = row["functionname"]
+                    spec = _irdb_value(row["protocol"], int(row["device"]),
+                                       int(row["subdevice"] or -1),
+                                       int(row["function"]))
+                    if (spec is None):
+                        errors.append("Protocol {} is not supported, line {} "
+                                      "in file {}".format(row["protocol"],
+                                                          line_num, path))
+                        continue
+                else:
+                    key = row["name"]
+                    spec = (row["protocol"].upper(), int(row["bits"]),
+                            int(row["value"], 0))
+            except (KeyError, ValueError):
+                errors.append("CSV entry malformatted, line {} in file {}"
+                              "".format(line_num, path))
+                continue
+            if (spec[0] not in IR_type_id):
+                errors.append("IR proto '{}' is not known, line {} in file {}"
+                              "".format(spec[0], line_num, path))
+                continue
+            code = IR(type=spec[0], bits=spec[1], value=spec[2])
+            key = clean_name(key)
+            if (code in keys):
+                if (keys[code] != key):
+                    errors.append("Duplicate code for {} and {}, line {} in "
+                                  "file {}".format(keys[code], key, line_num,
+                                                   path))
+                continue
+            keys[code] = key
+            result[code] = _unique_name(key, taken)
+    return [Remote(name, path, result, errors)]
+
+
+def parse_file(path):
+    """
+        Reads a file in either format, determined by its extension.
+
+        :returns: list of `Remote` instances.
+    """
+    try:
+        if (path.lower().endswith(".csv")):
+            return parse_csv(path)
+        return parse_lirc(path)
+    except (OSError, UnicodeError) as e:
+        return [Remote(clean_name(os.path.basename(path)), path, {},
+                       ["Could not read {}: {}".format(path, e)])]
+
+
+def parse_files(paths, workers=None, chunksize=8, progress=None):
+    """
+        Parses the files in a process pool.
+
+        :param workers: Number of processes, defaults to the number of cores.
+        :param chunksize: Number of files handed to a process at once.
+        :param progress: Called with (files done, total files) as the files
+            are parsed.
+        :returns: list of `Remote` instances, in the order of the paths.
+    """
+    remotes = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for done, result in enumerate(executor.map(parse_file, paths,
+                                                   chunksize=chunksize), 1):
+            remotes.extend(result)
+            if (progress is not None):
+                progress(done, len(paths))
+    return remotes
+
+
+class Merged:
+    """
+        The result of merging remotes.
+
+        :ivar remotes: OrderedDict of prefix: dict of IR code: name.
+        :ivar sources: dict of prefix: the file it was read from.
+        :ivar duplicates: Remotes that were skipped as identical to another,
+            list of (name, name of the identical remote).
+        :ivar conflicts: Codes in several remotes, list of (code, ir_name,
+            ir_name of the earlier remote).
+        :ivar errors: list of str.
+    """
+    def __init__(self):
+        self.remotes = OrderedDict()
+        self.sources = {}
+        self.duplicates = []
+        self.conflicts = []
+        self.errors = []
+
+
+def merge(remotes, drop_conflicts=False):
+    """
+        Merges remotes, see the module documentation.
+
+        :param drop_conflicts: Leave codes that are already used by another
+            remote out, such that every code has only one name.
+        :returns: `Merged`
+    """
+    merged = Merged()
+    identical = {}
+    owners = {}
+    for remote in remotes:
+        merged.errors.extend(remote.errors)
+        if (not remote.codes):
+            continue
+        key = frozenset(remote.codes.items())
+        if (key in identical):
+            merged.duplicates.append((remote.name, identical[key]))
+            continue
+        identical[key] = remote.name
+
+        prefix = remote.name + "_"
+        suffix = 1
+        while (prefix in merged.remotes):
+            suffix += 1
+            prefix = "{}_{}_".format(remote.name, suffix)
+
+        codes = {}
+        for code, name in remote.codes.items():
+            ir_name = prefix + name
+            if (code in owners):
+                merged.conflicts.append((code, ir_name, owners[code]))
+                if (drop_conflicts):
+                    continue
+            owners[code] = ir_name
+            codes[code] = name
+        merged.remotes[prefix] = codes
+        merged.sources[prefix] = remote.source
+    return merged
+
+
+def write(merged, directory):
+    """
+        Writes every remote to its own code file in the directory.
+
+        :returns: list of the paths written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for prefix, codes in merged.remotes.items():
+        if (not codes):
+            continue
+        path = os.path.join(directory, prefix.rstrip("_") + ".txt")
+        write_code_file(path, codes, prefix, "Imported from {}".format(
+                        merged.sources[prefix]))
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description="Import LIRC and CSV remote "
+                                     "definitions as IR code files.")
+    parser.add_argument("files", nargs="+", help="The files to import.")
+    parser.add_argument("-o", "--output", default=".",
+                        help="Directory to write the code files to.")
+    parser.add_argument("-j", "--jobs", default=None, type=int,
+                        help="Number of processes, defaults to the cores.")
+    parser.add_argument("--drop-conflicts", default=False,
+                        action="store_true", help="Leave codes out that are "
+                        "already used by another remote.")
+    parser.add_argument("-v", "--verbose", default=False,
+                        action="store_true", help="Print every error and "
+                        "conflict.")
+    args = parser.parse_args()
+
+    def progress(done, total):
+        if (done == total) or (done % 100 == 0):
+            sys.stderr.write("\rParsed {}/{} files".format(done, total))
+            if (done == total):
+                sys.stderr.write("\n")
+            sys.stderr.flush()
+
+    start = time.monotonic()
+    remotes = parse_files(args.files, args.jobs, progress=progress)
+    merged = merge(remotes, args.drop_conflicts)
+    paths = write(merged, args.output)
+    duration = time.monotonic() - start
+
+    if (args.verbose):
+        for error in merged.errors:
+            print(error)
+        for code, ir_name, other in merged.conflicts:
+            print("Conflict: {} is {} and {}".format(code.config_print(),
+                                                      other, ir_name))
+    print("Wrote {} remotes with {} codes in {:.1f} s, skipped {} identical "
+          "remotes, {} conflicts, {} errors.".format(
+              len(paths), sum(len(c) for c in merged.remotes.values()),
+              duration, len(merged.duplicates), len(merged.conflicts),
+              len(merged.errors)))
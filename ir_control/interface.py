@@ -23,21 +23,296 @@
 # SOFTWARE.
 
 
-import argparse
-from collections import namedtuple
-import json
+import collections
 import logging
+import os
 import serial
-import sys
 import threading
 import time
 import queue
 
 from . import message
+from . import framing
+from . import raw
 
 logger = logging.getLogger(__name__)
 
 
+class MessageQueue:
+    """
+        A queue for messages with an optional maximum size and age. What
+        happens when a message is put on a full queue is determined by the
+        policy:
+
+            - "block": wait until there is space, raises `queue.Full` if the
+                timeout expires.
+            - "drop_newest": discard the message that was to be put.
+            - "drop_oldest": discard the oldest message in the queue.
+            - "collapse": discard the message if it is identical to the last
+                message in the queue, otherwise behave as "drop_newest".
+
+        Messages that are older than `max_age` seconds when they are retrieved
+        are discarded. All discarded messages are counted in `drops`.
+
+        :param maxsize: Maximum number of messages, 0 means unbounded.
+        :type maxsize: int
+        :param policy: The policy for when the queue is full.
+        :type policy: str
+        :param max_age: Maximum age of a message in seconds, or None.
+        :type max_age: float
+        :param timeout: Maximum time to block for the "block" policy, the
+            serial thread puts received messages, so this must be finite.
+        :type timeout: float
+    """
+    policies = ("block", "drop_newest", "drop_oldest", "collapse")
+
+    def __init__(self, maxsize=0, policy="block", max_age=None, timeout=1.0):
+        if (policy not in self.policies):
+            raise ValueError("Unknown queue policy {}".format(policy))
+        if (timeout is None) or (timeout < 0):
+            raise ValueError("The timeout must be a finite number of "
+                             "seconds.")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_age = max_age
+        self.timeout = timeout
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.drops = {"full": 0, "collapsed": 0, "expired": 0}
+
+    def _full(self):
+        return (self.maxsize > 0) and (len(self.queue) >= self.maxsize)
+
+    def put(self, item):
+        """
+            Puts a message on the queue, with the "block" policy this waits
+            at most `timeout` seconds for space.
+
+            :raises queue.Full: If the queue blocks and remained full.
+        """
+        entry = (time.monotonic(), item)
+        with self.condition:
+            if (self.policy == "collapse") and (self.queue) and (
+                    bytes(self.queue[-1][1]) == bytes(item)):
+                self.drops["collapsed"] += 1
+                return
+            if (self._full()):
+                if (self.policy == "block"):
+                    if (not self.condition.wait_for(lambda: not self._full(),
+                                                    self.timeout)):
+                        self.drops["full"] += 1
+                        raise queue.Full
+                elif (self.policy == "drop_oldest"):
+                    self.queue.popleft()
+                    self.drops["full"] += 1
+                else:
+                    self.drops["full"] += 1
+                    return
+            self.queue.append(entry)
+
+    def get_nowait(self):
+        with self.condition:
+            while (self.queue):
+                timestamp, item = self.queue.popleft()
+                self.condition.notify()
+                if (self.max_age is not None) and (
+                        time.monotonic() - timestamp > self.max_age):
+                    self.drops["expired"] += 1
+                    continue
+                return item
+        raise queue.Empty
+
+    def peek(self):
+        """
+            Returns the oldest message without removing it, or None.
+        """
+        with self.condition:
+            return self.queue[0][1] if self.queue else None
+
+    def prune(self):
+        """
+            Discards the messages that are older than the maximum age.
+        """
+        if (self.max_age is None):
+            return
+        with self.condition:
+            limit = time.monotonic() - self.max_age
+            while (self.queue) and (self.queue[0][0] < limit):
+                self.queue.popleft()
+                self.drops["expired"] += 1
+            self.condition.notify_all()
+
+    def total_drops(self):
+        return sum(self.drops.values())
+
+    def empty(self):
+        return not self.queue
+
+    def qsize(self):
+        return len(self.queue)
+
+
+class DeviceMirror:
+    """
+        A copy of the configuration and status of the device, such that these
+        can be read without a round trip to the device. The copy is updated
+        by the get_config and get_status replies and by set_config. It is
+        invalidated when the serial port is reconnected and the configuration
+        is forgotten when the uptime of the device goes backwards, as it was
+        reset.
+
+        :param max_age: Default maximum age in seconds of a cached value.
+        :type max_age: float
+    """
+    def __init__(self, max_age=1.0):
+        self.max_age = max_age
+        self.condition = threading.Condition()
+        self.values = {}  # msg_type: (time received, copy of the body).
+
+    def invalidate(self):
+        with self.condition:
+            self.values.clear()
+
+    def update(self, msg):
+        """
+            Processes a received message, other messages are ignored.
+        """
+        if (msg.msg_type == message.msg_type.get_config):
+            value = message.MsgConfig.from_buffer_copy(msg.config)
+        elif (msg.msg_type == message.msg_type.get_status):
+            value = message.MsgStatus.from_buffer_copy(msg.status)
+        else:
+            return
+        with self.condition:
+            previous = self.values.get(message.msg_type.get_status)
+            if (msg.msg_type == message.msg_type.get_status) and (
+                    previous is not None) and (
+                    value.uptime < previous[1].uptime):
+                logger.info("Device uptime went backwards, it was reset.")
+                self.values.pop(message.msg_type.get_config, None)
+            self.values[msg.msg_type] = (time.monotonic(), value)
+            self.condition.notify_all()
+
+    def get(self, msg_type, put_message, max_age=None, timeout=1.0):
+        """
+            Returns the cached value, or requests it from the device if it is
+            older than max_age seconds.
+
+            :param msg_type: get_config or get_status.
+            :param put_message: Function to send the request with.
+            :returns: `message.MsgConfig` or `message.MsgStatus`, or None if
+                the device did not reply within the timeout.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        requested = time.monotonic()
+        with self.condition:
+            entry = self.values.get(msg_type)
+            if (entry is not None) and (requested - entry[0] <= max_age):
+                return entry[1]
+        msg = message.Msg()
+        msg.msg_type = msg_type
+        put_message(msg)
+
+        def replied():
+            entry = self.values.get(msg_type)
+            return (entry is not None) and (entry[0] >= requested)
+        with self.condition:
+            if (self.condition.wait_for(replied, timeout)):
+                return self.values[msg_type][1]
+        return None
+
+    def set_config(self, config, put_message):
+        """
+            Sends the configuration, unless the device already has it.
+
+            :returns: Whether it was sent.
+        """
+        with self.condition:
+            entry = self.values.get(message.msg_type.get_config)
+            if (entry is not None) and (bytes(entry[1]) == bytes(config)):
+                return False
+        msg = message.Msg()
+        msg.msg_type = msg.type.set_config
+        msg.config = config
+        put_message(msg)
+        with self.condition:
+            self.values[message.msg_type.get_config] = (
+                time.monotonic(), message.MsgConfig.from_buffer_copy(config))
+        return True
+
+
+class RepeatCoalescer:
+    """
+        Combines identical consecutive action_IR_send messages into a single
+        action_IR_repeat message, which the firmware sends as the code
+        followed by the protocol's repeat frames. This takes a fraction of the
+        airtime and serial traffic of sending the code each time.
+
+        The first message is held for at most `window` seconds to wait for
+        identical ones, a different message sends it immediately.
+
+        :param window: Seconds to wait for identical messages.
+        :type window: float
+    """
+    # the firmware blocks while sending the repeats, keep it to about a
+    # second, more are sent in the next repeat message.
+    max_count = 9
+
+    def __init__(self, window=0.1):
+        self.window = window
+        self.pending = None
+        self.count = 0
+        self.deadline = 0
+        self.coalesced = 0
+
+    def feed(self, msg, now):
+        """
+            Adds a message to be sent.
+
+            :returns: list of `message.Msg` to be sent now.
+        """
+        out = self.poll(now)
+        if (msg.msg_type != message.msg_type.action_IR_send):
+            return out + self.flush() + [msg]
+        if (self.pending is not None) and (self.count < self.max_count) and (
+                bytes(msg.ir_specification) ==
+                bytes(self.pending.ir_specification)):
+            self.count += 1
+            self.coalesced += 1
+            return out
+        out += self.flush()
+        self.pending = msg
+        self.count = 0
+        self.deadline = now + self.window
+        return out
+
+    def poll(self, now):
+        """
+            Returns the held message if its window expired.
+        """
+        if (self.pending is not None) and (now >= self.deadline):
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+            Returns the held message, as a repeat message if it was repeated.
+        """
+        if (self.pending is None):
+            return []
+        msg = self.pending
+        if (self.count):
+            spec = msg.ir_specification
+            msg = message.Msg()
+            msg.msg_type = msg.type.action_IR_repeat
+            msg.ir_repeat.type = spec.type
+            msg.ir_repeat.bits = spec.bits
+            msg.ir_repeat.value = spec.value
+            msg.ir_repeat.count = self.count
+        self.pending = None
+        return [msg]
+
+
 class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
     """
         Class to handle communication with the serial port. It uses a separate
@@ -49,20 +324,82 @@ class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
         method. Reading received messages is done with the `get_message`
         method.
 
+        If the serial port is lost, the thread reconnects to it. If the port
+        is a device path, this path is polled with an exponential backoff,
+        starting at `reconnect_min_delay` seconds. Messages to be sent remain
+        in the tx queue while disconnected and are sent after reconnecting,
+        the queue's size and maximum age bound how many are kept.
+
         :param packet_size: The size of all messages in bytes.
         :type packet_size: int
+        :param rx_queue: The queue for received messages, defaults to an
+            unbounded `MessageQueue`.
+        :type rx_queue: `MessageQueue`
+        :param tx_queue: The queue for messages to be sent, defaults to an
+            unbounded `MessageQueue`.
+        :type tx_queue: `MessageQueue`
+        :param coalesce_window: If set, identical IR codes sent within this
+            many seconds are combined, see `RepeatCoalescer`.
+        :type coalesce_window: float
+
+        The configuration and status of the device are mirrored, see
+        `get_config`, `get_status` and `set_config`.
     """
-    def __init__(self, packet_size=64):
+    reconnect_min_delay = 0.002
+    reconnect_max_delay = 0.5
+
+    # seconds to wait at most for the device to answer after connecting,
+    # before negotiating baudrate/protocol.
+    ready_timeout = 2.0
+
+    # flow control for raw chunks; the number of chunks that may be sent
+    # before they are acknowledged, and when to assume an ack was lost.
+    raw_window = 4
+    raw_ack_timeout = 0.5
+
+    def __init__(self, packet_size=64, rx_queue=None, tx_queue=None,
+                 coalesce_window=None):
         super().__init__()
         self.ser = None
         self.running = False
 
         self.packet_size = packet_size
 
-        self.rx = queue.Queue()
-        self.tx = queue.Queue()
+        self.rx = rx_queue if rx_queue is not None else MessageQueue()
+        self.tx = tx_queue if tx_queue is not None else MessageQueue()
+
+        # connection parameters, used for reconnecting.
+        self.serial_port = None
+        self.serial_kwargs = {}
+        self.link_baudrate = None
+        self.link_protocol = framing.PROTOCOL_V1
+
+        # the protocol in use on the serial port.
+        self.protocol = framing.PROTOCOL_V1
+        self.decoder = framing.FrameDecoder()
+
+        # copy of the state of the device.
+        self.mirror = DeviceMirror()
+
+        # combines repeated IR codes before they are sent.
+        self.coalescer = None
+        if (coalesce_window is not None):
+            self.coalescer = RepeatCoalescer(coalesce_window)
 
-    def connect(self, serial_port, baudrate=9600, **kwargs):
+        # raw chunks that were sent but not yet acknowledged.
+        self.raw_outstanding = 0
+        self.raw_sent_at = 0
+
+        # reconnection state and outage statistics.
+        self.reconnect_delay = self.reconnect_min_delay
+        self.reconnect_at = 0
+        self.outage_start = None
+        self.outage_drops = 0
+        self.outages = {"count": 0, "total_duration": 0.0,
+                        "last_duration": 0.0, "last_lost": 0, "lost": 0}
+
+    def connect(self, serial_port, baudrate=9600, link_baudrate=None,
+                link_protocol=framing.PROTOCOL_V1, **kwargs):
         """
             Connects the object to a serial port.
 
@@ -70,20 +407,90 @@ class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
             :type serial_port: str
             :param baudrate: The baudrate to use.
             :type baudrate: int
+            :param link_baudrate: Baudrate to negotiate with the firmware
+                after connecting, this is renegotiated on reconnects.
+            :type link_baudrate: int
+            :param link_protocol: Protocol version to negotiate with the
+                firmware after connecting, see `framing`.
+            :type link_protocol: int
         """
-        packet_read_timeout = self.packet_size * (1.1 / baudrate)
+        self.serial_port = serial_port
+        self.serial_kwargs = dict(kwargs, baudrate=baudrate)
+        self.link_baudrate = link_baudrate
+        self.link_protocol = link_protocol
+        if (self._open()):
+            return True
+        logger.warn("Failed to connect to {}".format(serial_port))
+        self._lost()
+        return False
 
+    def _open(self):
+        baudrate = self.serial_kwargs["baudrate"]
+        packet_read_timeout = self.packet_size * (1.1 / baudrate)
         try:
-            self.ser = serial.Serial(serial_port,
-                                     baudrate=baudrate,
+            self.ser = serial.Serial(self.serial_port,
                                      timeout=packet_read_timeout,
-                                     **kwargs)
-            logger.debug("Succesfully connected to {}.".format(serial_port))
+                                     **self.serial_kwargs)
+            logger.debug("Succesfully connected to {}.".format(
+                         self.serial_port))
+            self.protocol = framing.PROTOCOL_V1
+            self.decoder = framing.FrameDecoder()
+            self.mirror.invalidate()  # most boards reset on connecting.
+            if (self.link_baudrate) or (
+                    self.link_protocol != framing.PROTOCOL_V1):
+                # most boards reset on connecting, wait for them to boot.
+                wait_ready(self.ser, timeout=self.ready_timeout)
+            if (self.link_baudrate):
+                negotiate_baudrate(self.ser, self.link_baudrate)
+            if (self.link_protocol != framing.PROTOCOL_V1):
+                self.protocol = negotiate_protocol(self.ser,
+                                                   self.link_protocol)
             return True
-        except serial.SerialException as e:
-            logger.warn("Failed to connect to {}".format(serial_port))
+        except (serial.SerialException, OSError) as e:
+            if (self.ser is not None):
+                self.ser.close()
+                self.ser = None
             return False
 
+    # Called when the connection is lost, starts the outage.
+    def _lost(self):
+        if (self.ser is not None):
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.ser = None
+        if (self.outage_start is None):
+            self.outage_start = time.monotonic()
+            self.outage_drops = self.tx.total_drops()
+            self.reconnect_delay = self.reconnect_min_delay
+            self.reconnect_at = self.outage_start
+
+    def _reconnect(self):
+        now = time.monotonic()
+        if (self.serial_port is None) or (now < self.reconnect_at):
+            return
+        # polling the device path is cheap, only try to open if it exists.
+        is_path = self.serial_port.startswith("/")
+        if ((not is_path) or os.path.exists(self.serial_port)) and (
+                self._open()):
+            self.tx.prune()  # discard what got too old during the outage.
+            duration = now - self.outage_start
+            lost = self.tx.total_drops() - self.outage_drops
+            self.outages["count"] += 1
+            self.outages["total_duration"] += duration
+            self.outages["last_duration"] = duration
+            self.outages["last_lost"] = lost
+            self.outages["lost"] += lost
+            self.outage_start = None
+            logger.warn("Reconnected to {} after {:.3f} s, {} messages to be "
+                        "sent were lost.".format(self.serial_port, duration,
+                                                 lost))
+            return
+        self.reconnect_at = now + self.reconnect_delay
+        self.reconnect_delay = min(self.reconnect_delay * 2,
+                                   self.reconnect_max_delay)
+
     def stop(self):
         """
             Cleanly shuts down the running thread and closes the serial port.
@@ -93,42 +500,88 @@ class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
         if (self.ser):
             self.ser.close()
 
+    def _queue_received(self, msgs):
+        for msg in msgs:
+            if (msg.msg_type == message.msg_type.raw_ack):
+                # handled here for the flow control, not passed on.
+                self.raw_outstanding = max(0, self.raw_outstanding - 1)
+                if (msg.raw_chunk.flags & raw.RAW_ERROR):
+                    logger.warn("Raw chunk {} rejected.".format(
+                                msg.raw_chunk.sequence))
+                continue
+            self.mirror.update(msg)
+            try:
+                self.rx.put(msg)
+            except queue.Full:
+                pass  # counted by the queue.
+
     def _process_rx(self):
         # try to read message from serial port
         try:
-            if (self.ser.inWaiting()):
+            if (self.protocol == framing.PROTOCOL_V2):
+                waiting = self.ser.inWaiting()
+                if (waiting):
+                    self._queue_received(self.decoder.feed(
+                        self.ser.read(waiting)))
+            elif (self.ser.inWaiting()):
                 buffer = bytearray(self.packet_size)
                 d = self.ser.readinto(buffer)
 
                 # Did we get the correct number of bytes? If so queue it.
                 if (d == self.packet_size):
-                    msg = message.Msg.read(buffer)
-                    self.rx.put_nowait(msg)
+                    self._queue_received([message.Msg.read(buffer)])
                 else:
                     logging.warn("Received incomplete packet "
                                  " discarded ({}).".format(buffer))
         except (serial.SerialException, OSError, IOError) as e:
-            self.ser.close()
-            self.ser = None
+            self._lost()
 
     def _process_tx(self):
-        # try to put a message on the serial port from the queue
-        try:
-            msg = self.tx.get_nowait()
-        except queue.Empty:
-            pass  # there was no data there.
+        # messages stay in the queue while there is no serial port.
+        if (self.ser is None):
             return
 
-        if (self.ser is None):
-            logging.warn("Trying to send on a closed serial port.")
+        # try to put a message on the serial port from the queue, with version
+        # 2 of the protocol all pending messages are batched in frames.
+        msgs = []
+        limit = 1 if self.protocol == framing.PROTOCOL_V1 else \
+            framing.MAX_IR_PER_FRAME
+        if (self.raw_outstanding) and (
+                time.monotonic() - self.raw_sent_at > self.raw_ack_timeout):
+            logger.warn("Raw chunk not acknowledged, continuing.")
+            self.raw_outstanding = 0
+        while (len(msgs) < limit):
+            # raw chunks are only sent if the window allows it.
+            pending = self.tx.peek()
+            is_raw = (pending is not None) and (
+                pending.msg_type == message.msg_type.action_raw_send)
+            if (is_raw) and (self.raw_outstanding >= self.raw_window):
+                break
+            try:
+                msgs.append(self.tx.get_nowait())
+            except queue.Empty:
+                break  # there was no data there.
+            if (is_raw):
+                self.raw_outstanding += 1
+                self.raw_sent_at = time.monotonic()
+        if (self.coalescer is not None):
+            now = time.monotonic()
+            msgs = sum((self.coalescer.feed(m, now) for m in msgs),
+                       self.coalescer.poll(now))
+        if (not msgs):
             return
 
         try:
-            logger.debug("Processing {}".format(msg))
-            self.ser.write(bytes(msg))
-        except serial.SerialException:
-            self.ser.close()
-            self.ser = None
+            # formatted only if debug logging is enabled.
+            logger.debug("Processing %s", msgs,
+                         extra={"device": self.serial_port})
+            if (self.protocol == framing.PROTOCOL_V1):
+                self.ser.write(b"".join(bytes(m) for m in msgs))
+            else:
+                self.ser.write(framing.encode_messages(msgs))
+        except (serial.SerialException, OSError):
+            self._lost()
+            self.outage_drops -= len(msgs)  # these are lost as well.
 
     def run(self):
         # this method is called when the thread is started.
@@ -137,10 +590,13 @@ class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
             # small sleep to prevent this loop from running too fast.
             time.sleep(0.001)
 
-            self._process_tx()  # read from the tx queue
-
             if (self.ser is None):
+                self._reconnect()
                 continue
+
+            self._process_tx()  # read from the tx queue
+            if (self.ser is None):
+                continue  # lost while writing.
             self._process_rx()  # read from serial port
 
     def is_serial_connected(self):
@@ -169,8 +625,10 @@ class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
             :param message: The message to be transmitted on the serial port.
             :type message: Some object which is a valid input argument to
                 the `bytes` function.
+            :raises queue.Full: If the queue uses the "block" policy and
+                remained full for its timeout.
         """
-        self.tx.put_nowait(message)
+        self.tx.put(message)
 
     def get_message(self):
         """
@@ -184,8 +642,70 @@ class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
         except queue.Empty:
             return None
 
+    def get_config(self, max_age=None, timeout=1.0):
+        """
+            Returns the configuration of the device, from the mirror if it is
+            at most max_age seconds old.
+
+            :param max_age: Maximum age, defaults to `mirror.max_age`.
+            :type max_age: float
+            :param timeout: Time to wait for the reply of the device.
+            :type timeout: float
+            :returns: `message.MsgConfig` or None if the device did not reply.
+        """
+        return self.mirror.get(message.msg_type.get_config, self.put_message,
+                               max_age, timeout)
+
+    def get_status(self, max_age=None, timeout=1.0):
+        """
+            Returns the status of the device, like `get_config`.
+
+            :returns: `message.MsgStatus` or None if the device did not reply.
+        """
+        return self.mirror.get(message.msg_type.get_status, self.put_message,
+                               max_age, timeout)
+
+    def set_config(self, config):
+        """
+            Sends the configuration to the device if it differs from the
+            configuration in the mirror.
+
+            :param config: The configuration.
+            :type config: `message.MsgConfig`
+            :returns: Whether it was sent.
+        """
+        return self.mirror.set_config(config, self.put_message)
+
+    def get_outage_statistics(self):
+        """
+            Returns statistics about the times the serial port was lost.
+
+            :returns: dict with the "count" and "total_duration" of outages,
+                the duration of the last one and the messages to be sent that
+                were "lost" during outages.
+        """
+        return dict(self.outages)
+
+    def get_frame_errors(self):
+        """
+            Returns the number of corrupt version 2 frames that were discarded.
+
+            :returns: int
+        """
+        return self.decoder.errors
+
+    def get_drop_counts(self):
+        """
+            Returns the number of messages discarded by the rx and tx queues.
+
+            :returns: dict with "rx" and "tx" fields holding the counts per
+                reason.
+        """
+        return {"rx": dict(self.rx.drops), "tx": dict(self.tx.drops)}
+
     # for command line tool
     def wait_for_message(self):
+        m = None
         while(True):
             try:
                 time.sleep(0.01)
@@ -197,31 +717,543 @@ class SerialInterface(threading.Thread):  # Also known as 'SerialMan!'.
         return m
 
 
-if __name__ == "__main__":
-    # Create a simple commandline interface.
+def _serial_process(conn, packet_size, queues, log_level,
+                    coalesce_window=None):
+    # Runs in the child process; owns the serial port and relays the frames
+    # over the pipe to the ProcessSerialInterface in the parent. The child
+    # is spawned, so logging is set up from scratch and goes to stderr.
+    logging.basicConfig(format="%(name)s - %(asctime)s - %(levelname)s"
+                        " - %(message)s")
+    logger.setLevel(log_level)
+    interface = SerialInterface(packet_size=packet_size,
+                                rx_queue=MessageQueue(*queues[0]),
+                                tx_queue=MessageQueue(*queues[1]),
+                                coalesce_window=coalesce_window)
+    interface.start()
+    connected = None
+    frame_errors = 0
+    try:
+        while (True):
+            if (not interface.is_alive()):
+                # exiting lets the parent restart us.
+                logger.error("Serial thread died, exiting.")
+                return
+            while (conn.poll()):
+                command = conn.recv()
+                if (command[0] == "tx"):
+                    try:
+                        interface.put_message(message.Msg.read(command[1]))
+                    except queue.Full:
+                        pass  # counted by the queue.
+                elif (command[0] == "connect"):
+                    if (not interface.is_serial_connected()):
+                        interface.connect(*command[1:])
+                elif (command[0] == "stop"):
+                    return
+
+            msg = interface.get_message()
+            while (msg is not None):
+                conn.send(("rx", bytes(msg)))
+                msg = interface.get_message()
+
+            if (interface.get_frame_errors() != frame_errors):
+                frame_errors = interface.get_frame_errors()
+                conn.send(("frame_errors", frame_errors))
+
+            state = interface.is_serial_connected()
+            if (state != connected):
+                connected = state
+                conn.send(("outages", interface.get_outage_statistics()))
+                conn.send(("connected", state))
+            time.sleep(0.001)
+    except (EOFError, OSError, KeyboardInterrupt):
+        pass  # parent is gone.
+    finally:
+        interface.stop()
+        interface.join()
+
+
+class ProcessSerialInterface(threading.Thread):
+    """
+        Provides the same interface as `SerialInterface`, but the serial port
+        is handled by a `SerialInterface` in a child process. This ensures
+        that actions that hold the GIL for a long time in this process cannot
+        delay reading from the serial port. The frames are exchanged with the
+        child over a pipe, if the child dies it is restarted and reconnected.
+
+        The child is started with forkserver or spawn rather than fork, as
+        the parent runs threads whose locks would be copied in any state.
+        This imports the main script again in the child, the script must
+        therefore only start the interface under `if __name__ == "__main__"`.
+        The size, policy and maximum age of the queues are used for the
+        queues in the child as well.
+
+        :param packet_size: The size of all messages in bytes.
+        :type packet_size: int
+        :param restart_delay: Seconds to wait before restarting the child.
+        :type restart_delay: float
+        :param rx_queue: The queue for received messages.
+        :type rx_queue: `MessageQueue`
+        :param tx_queue: The queue for messages to be sent.
+        :type tx_queue: `MessageQueue`
+        :param coalesce_window: Passed to the `SerialInterface`.
+        :type coalesce_window: float
+    """
+    def __init__(self, packet_size=64, restart_delay=0.1, rx_queue=None,
+                 tx_queue=None, coalesce_window=None):
+        super().__init__()
+        self.daemon = True
+        self.running = False
+        self.packet_size = packet_size
+        self.restart_delay = restart_delay
+        self.coalesce_window = coalesce_window
+        self.restarts = 0
+
+        self.rx = rx_queue if rx_queue is not None else MessageQueue()
+        self.tx = tx_queue if tx_queue is not None else MessageQueue()
+
+        self.serial_parameters = None
+        self.connected = False
+        self.outages = {}
+        self.frame_errors = 0
+        self.mirror = DeviceMirror()
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()  # no child is spawned after stop().
+
+        # forkserver forks restarted children from a clean single threaded
+        # server, which is cheaper than spawning a new interpreter each time.
+        import multiprocessing
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn")
+
+    def _spawn(self):
+        self.conn, child_conn = self.context.Pipe()
+        queues = [(q.maxsize, q.policy, q.max_age, q.timeout)
+                  for q in (self.rx, self.tx)]
+        self.process = self.context.Process(target=_serial_process,
+                                            args=(child_conn,
+                                                  self.packet_size,
+                                                  queues,
+                                                  logger.getEffectiveLevel(),
+                                                  self.coalesce_window),
+                                            daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.connected = False
+        if (self.serial_parameters is not None):
+            self.conn.send(("connect",) + self.serial_parameters)
+
+    def connect(self, serial_port, baudrate=9600, link_baudrate=None,
+                link_protocol=framing.PROTOCOL_V1):
+        """
+            Connects the child process to a serial port, the child is started
+            if necessary.
+
+            :param serial_port: The path to the serial port to connect to.
+            :type serial_port: str
+            :param baudrate: The baudrate to use.
+            :type baudrate: int
+            :param link_baudrate: Baudrate to negotiate with the firmware.
+            :type link_baudrate: int
+            :param link_protocol: Protocol version to negotiate.
+            :type link_protocol: int
+        """
+        self.serial_parameters = (serial_port, baudrate, link_baudrate,
+                                  link_protocol)
+        if (self.process is None):
+            self._spawn()
+        else:
+            self.conn.send(("connect",) + self.serial_parameters)
+        return True
+
+    def stop(self):
+        """
+            Stops the relaying thread and the child process.
+        """
+        with self.lock:
+            self.running = False
+            if (self.process is not None):
+                try:
+                    self.conn.send(("stop",))
+                except OSError:
+                    pass
+                self.process.join(1.0)
+                if (self.process.is_alive()):
+                    self.process.terminate()
+
+    def _restart(self):
+        self.process.join(self.restart_delay)
+        if (self.process.is_alive()):
+            self.process.terminate()
+            self.process.join()
+        logger.error("Serial process died (exit code {}), restarting.".format(
+                     self.process.exitcode))
+        self.conn.close()
+        time.sleep(self.restart_delay)
+        with self.lock:
+            if (not self.running):
+                return  # stopped in the meantime.
+            self.restarts += 1
+            self._spawn()
+
+    def run(self):
+        self.running = True
+        while (self.running):
+            if (self.process is None):
+                time.sleep(0.001)
+                continue
+            if (not self.process.is_alive()):
+                self._restart()
+                continue
+            try:
+                # relay messages to be sent to the child, while the child is
+                # disconnected they are kept in our queue.
+                while (self.connected):
+                    try:
+                        msg = self.tx.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.conn.send(("tx", bytes(msg)))
+
+                # relay messages received by the child.
+                if (self.conn.poll(0.001)):
+                    while (self.conn.poll()):
+                        reply = self.conn.recv()
+                        if (reply[0] == "rx"):
+                            msg = message.Msg.read(reply[1])
+                            self.mirror.update(msg)
+                            try:
+                                self.rx.put(msg)
+                            except queue.Full:
+                                pass  # counted by the queue.
+                        elif (reply[0] == "connected"):
+                            self.connected = reply[1]
+                            self.mirror.invalidate()
+                        elif (reply[0] == "outages"):
+                            self.outages = reply[1]
+                        elif (reply[0] == "frame_errors"):
+                            self.frame_errors = reply[1]
+            except (EOFError, OSError):
+                if (self.running):
+                    self._restart()
+
+    def is_serial_connected(self):
+        """
+            Returns whether the child process is connected to a serial port.
+
+            :returns: boolean
+        """
+        return self.connected
+
+    def get_serial_parameters(self):
+        """
+            Returns a dictionary holding the device and baudrate of the current
+            serial connection.
+
+            :returns: dict containing a "device" and "baudrate" field.
+        """
+        return {"device": self.serial_parameters[0],
+                "baudrate": self.serial_parameters[1]}
+
+    def get_frame_errors(self):
+        """
+            Returns the number of corrupt version 2 frames that the child
+            discarded.
+
+            :returns: int
+        """
+        return self.frame_errors
+
+    put_message = SerialInterface.put_message
+    get_message = SerialInterface.get_message
+    wait_for_message = SerialInterface.wait_for_message
+    get_drop_counts = SerialInterface.get_drop_counts
+    get_outage_statistics = SerialInterface.get_outage_statistics
+    get_config = SerialInterface.get_config
+    get_status = SerialInterface.get_status
+    set_config = SerialInterface.set_config
+
+
+def exchange(ser, msg, reply=True, timeout=1.0,
+             protocol=framing.PROTOCOL_V1):
+    """
+        Writes a message to an open serial port and waits until it is flushed
+        and optionally for the reply of the same type. Other messages that
+        arrive in the meantime are discarded.
+
+        :param ser: The serial port.
+        :type ser: `serial.Serial`
+        :param msg: The message to be transmitted.
+        :type msg: `message.Msg`
+        :param reply: Wait for a message of the same type in response.
+        :type reply: bool
+        :param timeout: The maximum time to wait for the reply in seconds.
+        :type timeout: float
+        :param protocol: The protocol version in use, see `framing`.
+        :type protocol: int
+        :returns: The reply as `message.Msg` or None.
+    """
+    if (protocol == framing.PROTOCOL_V1):
+        ser.write(bytes(msg))
+    else:
+        ser.write(framing.encode_messages([msg]))
+    ser.flush()  # blocks until all data is written.
+    if (not reply):
+        return None
+
+    # read packets until we get the response of the right type, other
+    # messages such as action_IR_received may arrive in the meantime.
+    deadline = time.monotonic() + timeout
+    buffer = bytearray(message.PACKET_SIZE)
+    decoder = framing.FrameDecoder()
+    while (time.monotonic() < deadline):
+        if (protocol == framing.PROTOCOL_V1):
+            if (ser.readinto(buffer) != message.PACKET_SIZE):
+                continue
+            msgs = [message.Msg.read(buffer)]
+        else:
+            msgs = decoder.feed(ser.read(max(1, ser.in_waiting)))
+        for m in msgs:
+            if (m.msg_type == msg.msg_type):
+                return m
+    return None
+
+
+def _set_port_baudrate(ser, baudrate):
+    ser.baudrate = baudrate
+    ser.timeout = message.PACKET_SIZE * (1.1 / baudrate)
+    ser.reset_input_buffer()
+
+
+def _verify(ser, timeout, protocol=framing.PROTOCOL_V1):
+    msg = message.Msg()
+    msg.msg_type = msg.type.get_status
+    return exchange(ser, msg, timeout=timeout, protocol=protocol) is not None
+
+
+def _request_protocol(ser, version, timeout, protocol):
+    msg = message.Msg()
+    msg.msg_type = msg.type.set_protocol
+    msg.protocol.version = version
+    return exchange(ser, msg, timeout=timeout, protocol=protocol)
+
+
+def negotiate_protocol(ser, version, timeout=0.2):
+    """
+        Negotiates the protocol version with the firmware. The request is sent
+        as a version 1 message, the firmware acknowledges it and switches.
+        The link is verified with `get_status` in the new version, if that
+        fails the firmware is asked to switch back to version 1.
+
+        If the firmware does not acknowledge, it may still be using the
+        requested version from an earlier negotiation, this is checked too.
+
+        :param ser: The open serial port.
+        :type ser: `serial.Serial`
+        :param version: The requested protocol version.
+        :type version: int
+        :param timeout: Time to wait for each reply in seconds.
+        :type timeout: float
+        :returns: The protocol version the link uses afterwards.
+    """
+    if (version == framing.PROTOCOL_V1):
+        return version
+    ack = _request_protocol(ser, version, timeout, framing.PROTOCOL_V1)
+    if (ack is None):
+        if (_verify(ser, timeout, protocol=version)):
+            logger.info("Link already uses protocol {}.".format(version))
+            return version
+        logger.warn("Protocol {} not acknowledged.".format(version))
+        return framing.PROTOCOL_V1
+
+    if (ack.protocol.version != version):
+        logger.warn("Protocol {} not supported by the firmware.".format(
+                    version))
+        return framing.PROTOCOL_V1
+
+    if (_verify(ser, timeout, protocol=version)):
+        logger.info("Switched link to protocol {}.".format(version))
+        return version
+
+    logger.warn("Verification of protocol {} failed, falling back.".format(
+                version))
+    _request_protocol(ser, framing.PROTOCOL_V1, timeout, version)
+    return framing.PROTOCOL_V1
+
+
+def negotiate_baudrate(ser, baudrate, timeout=0.2, revert_timeout=1.0):
+    """
+        Negotiates a different baudrate with the firmware. The firmware
+        acknowledges the request at the current speed and then switches, the
+        link is verified at the new speed with `get_status`. If verification
+        fails the firmware reverts by itself after `revert_timeout` and the
+        port is switched back as well.
+
+        If the firmware does not acknowledge, it may still be running at the
+        requested baudrate from an earlier negotiation, this is checked too.
+
+        :param ser: The open serial port, at the current baudrate.
+        :type ser: `serial.Serial`
+        :param baudrate: The requested baudrate.
+        :type baudrate: int
+        :param timeout: Time to wait for each reply in seconds.
+        :type timeout: float
+        :param revert_timeout: Time after which the firmware reverts an
+            unconfirmed switch, in seconds.
+        :type revert_timeout: float
+        :returns: The baudrate the link uses afterwards.
+    """
+    current = ser.baudrate
+    if (baudrate == current):
+        return current
+
+    msg = message.Msg()
+    msg.msg_type = msg.type.set_baudrate
+    msg.baudrate.baudrate = baudrate
+    ack = exchange(ser, msg, timeout=timeout)
+
+    if (ack is None):
+        # no acknowledgement, perhaps it already uses the requested speed.
+        _set_port_baudrate(ser, baudrate)
+        if (_verify(ser, timeout)):
+            logger.info("Link already at {} baud.".format(baudrate))
+            return baudrate
+        _set_port_baudrate(ser, current)
+        logger.warn("Baudrate {} not acknowledged.".format(baudrate))
+        return current
+
+    if (ack.baudrate.baudrate != baudrate):
+        logger.warn("Baudrate {} not supported by the firmware.".format(
+                    baudrate))
+        return current
+
+    _set_port_baudrate(ser, baudrate)
+    if (_verify(ser, timeout)):
+        logger.info("Switched link to {} baud.".format(baudrate))
+        return baudrate
+
+    # fall back, the firmware reverts once its verification timeout expires.
+    logger.warn("Verification at {} baud failed, falling back to {}.".format(
+                baudrate, current))
+    time.sleep(revert_timeout)
+    _set_port_baudrate(ser, current)
+    if (not _verify(ser, timeout)):
+        logger.error("No response after falling back to {} baud.".format(
+                     current))
+    return current
+
+
+def wait_ready(ser, timeout=2.0, interval=0.25):
+    """
+        Waits until the device on an open serial port answers a get_status
+        request. Most Arduino boards reset when the port is opened, anything
+        written while the bootloader runs is lost.
+
+        :param ser: The serial port.
+        :type ser: `serial.Serial`
+        :param timeout: The maximum time to wait in seconds.
+        :type timeout: float
+        :param interval: Seconds to wait for each reply before asking again.
+        :type interval: float
+        :returns: True if the device answered within the timeout.
+    """
+    probe = message.Msg()
+    probe.msg_type = message.msg_type.get_status
+    deadline = time.monotonic() + timeout
+    while (time.monotonic() < deadline):
+        if (exchange(ser, probe, reply=True, timeout=interval) is not None):
+            return True
+    return False
+
+
+def transact(serial_port, msg, baudrate=9600, reply=False, timeout=1.0,
+             settle=0.0, ready=2.0):
+    """
+        Sends a single message without starting the interface thread. The port
+        is opened, the message is written and flushed to the device and the
+        port is closed again. This is intended for scripted one-shot sends
+        where the startup time of the threaded interface is too costly.
+
+        DTR and RTS are kept low when opening the port, but on Linux the
+        port is opened with DTR raised regardless and boards like the Uno
+        reset. Before writing, the device is therefore asked for its status
+        until it answers, which costs a single round trip when it did not
+        reset. Pass 0 for `ready` to write immediately.
+
+        :param serial_port: The path to the serial port to connect to.
+        :type serial_port: str
+        :param msg: The message to be transmitted.
+        :type msg: `message.Msg`
+        :param reply: Wait for a message of the same type in response.
+        :type reply: bool
+        :param timeout: The maximum time to wait for the reply in seconds.
+        :type timeout: float
+        :param settle: Seconds to wait after opening the port before writing.
+        :type settle: float
+        :param ready: Seconds to wait for the device to answer before writing.
+        :type ready: float
+        :returns: The reply as `message.Msg` or None.
+    """
+    ser = serial.Serial()
+    ser.port = serial_port
+    ser.baudrate = baudrate
+    ser.timeout = message.PACKET_SIZE * (1.1 / baudrate)
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    try:
+        if (settle):
+            time.sleep(settle)
+        if (ready) and (not wait_ready(ser, timeout=ready)):
+            logger.warning("No answer from %s, writing anyway.", serial_port)
+        return exchange(ser, msg, reply=reply, timeout=timeout)
+    finally:
+        ser.close()
+
+
+def main():
+    # Create a simple commandline interface. These are only necessary here,
+    # importing them lazily keeps the startup time of one-shot sends low.
+    import argparse
+    import json
+    import sys
 
     parser = argparse.ArgumentParser(description="Control MCU at serial port.")
     parser.add_argument('--port', '-p', help="The serial port to connect to.",
                         default="/dev/ttyACM0")
+    parser.add_argument('--baudrate', '-r', help="The badurate for the port.",
+                        default=9600, type=int)
     parser.add_argument('--verbose', '-v', help="Print all communication.",
                         action="store_true", default=False)
     parser.add_argument('--listen', '-l',
                         help="Continue listening to communication",
                         action="store_true", default=False)
+    parser.add_argument('--timeout', '-t', help="Seconds to wait for a reply.",
+                        default=1.0, type=float)
+    parser.add_argument('--settle', help="Seconds to wait after opening the "
+                        "port, for boards that reset on connect. Defaults to "
+                        "1 second with --listen.", default=None, type=float)
+    parser.add_argument('--ready', help="Seconds to wait for the board to "
+                        "answer before a one-shot send, 0 to disable.",
+                        default=2.0, type=float)
 
     subparsers = parser.add_subparsers(dest="command")
 
-    # add subparsers for each command.
+    # add subparsers for each command, the help text is derived from the
+    # field layout such that no messages have to be constructed.
+    body_fields = dict(message._MsgBody._fields_)
     for i in range(0, len(message.msg_type_name)):
         command = message.msg_type_name[i]
         command_parser = subparsers.add_parser(command)
         if (command.startswith("set_") or command.startswith("action_")):
             if (i in message.msg_type_field):
                 fieldname = message.msg_type_field[i]
-                tmp = message.Msg()
-                tmp.msg_type = i
-                config = str(getattr(tmp, fieldname)).replace("'", '"')
-                helpstr = "Json representing configuration {}".format(config)
+                config = dict((k, 0) for k, t in
+                              body_fields[fieldname]._fields_)
+                helpstr = "Json representing configuration {}".format(
+                    json.dumps(config))
                 command_parser.add_argument('config', help=helpstr)
 
     # parse the arguments.
@@ -237,24 +1269,7 @@ if __name__ == "__main__":
     msg = message.Msg()
     msg.msg_type = getattr(msg.type, args.command)
 
-    # create the interface and connect to a serial port
-    a = SerialInterface(packet_size=message.PACKET_SIZE)
-    a.connect(args.port)
-    a.start()  # start the interface
-    time.sleep(1)
-
-    # we are retrieving something.
-    if (args.command.startswith("get_")):
-        if (args.verbose):
-            print("Sending: {}".format(bytes(msg)))
-        a.put_message(msg)
-        print("Waiting for message.")
-        m = a.wait_for_message()
-        if (args.verbose):
-            print("Retrieved: {}".format(bytes(m)))
-        print(m)
-
-    # sending something
+    # fill the payload if we are sending something
     if (args.command.startswith("set_") or args.command.startswith("action_")):
         command_id = getattr(message.msg_type, args.command)
         if (command_id in message.msg_type_field):
@@ -262,24 +1277,48 @@ if __name__ == "__main__":
             d = {fieldname: json.loads(args.config)}
             msg.from_dict(d)
         print("Sending {}".format(msg))
-        if (args.verbose):
-            print("Sending: {}".format(bytes(msg)))
+    if (args.verbose):
+        print("Sending: {}".format(bytes(msg)))
 
-        # send the message and wait until it is really gone.
-        a.put_message(msg)
-        while(not a.tx.empty()):
-            time.sleep(0.1)
+    # One shot; write the message, wait until it is flushed and for the reply
+    # if we are retrieving something.
+    if (not args.listen):
+        m = transact(args.port, msg, baudrate=args.baudrate,
+                     reply=args.command.startswith("get_"),
+                     timeout=args.timeout, settle=args.settle or 0.0,
+                     ready=args.ready)
+        if (m is not None):
+            if (args.verbose):
+                print("Retrieved: {}".format(bytes(m)))
+            print(m)
+        elif (args.command.startswith("get_")):
+            print("No reply received.")
+            sys.exit(1)
+        sys.exit(0)
 
-    if (args.listen):
-        while(True):
-            try:
-                m = a.wait_for_message()
-                if (args.verbose):
-                    print("Retrieved: {}".format(bytes(m)))
-                print(m)
-            except KeyboardInterrupt:
+    # create the interface and connect to a serial port
+    a = SerialInterface(packet_size=message.PACKET_SIZE)
+    a.connect(args.port, baudrate=args.baudrate)
+    a.start()  # start the interface
+    # give the board time to come out of the bootloader after the reset.
+    time.sleep(1.0 if args.settle is None else args.settle)
+
+    a.put_message(msg)
+    while(True):
+        try:
+            m = a.wait_for_message()
+            if (m is None):
                 break
+            if (args.verbose):
+                print("Retrieved: {}".format(bytes(m)))
+            print(m)
+        except KeyboardInterrupt:
+            break
 
     a.stop()
     a.join()
     sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
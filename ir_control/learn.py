@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Learning mode; collects the codes that are received but not known and
+    writes the frequent ones to a code file, such that setting up a new
+    remote only requires pressing its keys a few times and naming them.
+
+    The codes are counted with the space saving algorithm, which keeps a
+    fixed number of counters. If a code is received while all counters are
+    in use, the counter with the lowest count is given to it, and that count
+    is remembered as the possible overestimation of the new code. A flood of
+    noise therefore never uses more memory, and a code that is received more
+    often than total / capacity times is guaranteed to be kept. Only codes of
+    which the count minus the overestimation reaches `min_count` are
+    written, this leaves out codes that were received once due to noise.
+
+    This is done by `start()` if `--learn FILE` is passed:
+        learner = Learner()
+        interactor.add_listener(learner.listener)
+        ...
+        learner.write("new_remote.txt", prefix="new_remote_")
+"""
+
+from .message import IR, IR_type, IR_type_name
+from .config import write_code_file
+
+
+class SpaceSaving:
+    """
+        Approximate counts of the most frequent keys in a fixed number of
+        counters.
+
+        :param capacity: The number of counters.
+        :type capacity: int
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.counters = {}  # key: [count, overestimation, first seen]
+        self.total = 0
+
+    def add(self, key):
+        self.total += 1
+        counter = self.counters.get(key)
+        if (counter is not None):
+            counter[0] += 1
+            return
+        if (len(self.counters) < self.capacity):
+            self.counters[key] = [1, 0, self.total]
+            return
+        # replace the key with the lowest count.
+        victim = min(self.counters, key=lambda k: self.counters[k][0])
+        count = self.counters.pop(victim)[0]
+        self.counters[key] = [count + 1, count, self.total]
+
+    def items(self, min_count=1):
+        """
+            Returns the keys of which the guaranteed count is at least
+            min_count, as (key, count, guaranteed count) tuples in the order
+            they were first seen.
+        """
+        result = [(key, count, count - error, first)
+                  for key, (count, error, first) in self.counters.items()
+                  if count - error >= min_count]
+        return [r[:3] for r in sorted(result, key=lambda r: r[3])]
+
+
+class Learner:
+    """
+        :param capacity: The number of codes that are tracked.
+        :type capacity: int
+        :param min_count: Number of times a code must be received to be
+            written.
+        :type min_count: int
+    """
+    def __init__(self, capacity=256, min_count=3):
+        self.min_count = min_count
+        self.counts = SpaceSaving(capacity)
+
+    def add(self, ir_code):
+        irtype, bits, value = ir_code.tuple()
+        # codes that could not be decoded and repeat codes can not be sent.
+        # The firmware sends UNKNOWN as 255, it does not fit in its uint8_t.
+        if (irtype not in IR_type_name) or (irtype == IR_type.UNKNOWN) or (
+                bits == 0):
+            return
+        self.counts.add((irtype, bits, value))
+
+    # Listener signature, such that it can be passed to add_listener.
+    def listener(self, interactor, ir_code, ir_name):
+        if (ir_name is None):
+            self.add(ir_code)
+
+    def codes(self, min_count=None):
+        """
+            Returns the learned codes, in the order they were first received.
+
+            :returns: list of (`message.IR`, count) tuples.
+        """
+        min_count = self.min_count if min_count is None else min_count
+        return [(IR(*key), count)
+                for key, count, guaranteed in self.counts.items(min_count)]
+
+    def write(self, path, prefix=None, min_count=None):
+        """
+            Writes the learned codes to a code file, named key_1, key_2 and so
+            on in the order they were received.
+
+            :returns: The number of codes written.
+        """
+        codes = self.codes(min_count)
+        names = dict((code, "key_{}".format(i))
+                     for i, (code, count) in enumerate(codes, 1))
+        write_code_file(path, names, prefix, "Learned codes, received {} "
+                        "unknown codes.".format(self.counts.total))
+        return len(codes)
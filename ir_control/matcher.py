@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Error tolerant matching of received IR codes. Weak batteries or sunlight
+    can flip a bit or two of a code, the `HammingIndex` maps such a code to
+    the known code with the same type and bit count that is within a maximum
+    Hamming distance.
+
+    The index uses multi-index hashing; the bits of the value are split into
+    max_distance + 1 segments. A code that differs in at most max_distance
+    bits matches at least one of those segments exactly, so only the codes in
+    the buckets of the segments have to be compared, instead of all codes.
+"""
+
+
+def popcount(x):
+    return bin(x).count("1")
+
+
+class HammingIndex:
+    """
+        Index of the known codes to look up the nearest one.
+
+        :param codes: Mapping of code tuples (type, bits, value) to names.
+        :type codes: dict
+        :param max_distance: Maximum number of differing bits.
+        :type max_distance: int
+    """
+    def __init__(self, codes, max_distance=1):
+        self.max_distance = max_distance
+        self.matches = 0  # number of codes that were matched.
+        self.ambiguous = 0  # number of codes that were rejected as ambiguous.
+
+        # (type, bits) -> (segments, list of dicts segment value -> codes)
+        self.tables = {}
+        for code, name in codes.items():
+            irtype, bits, value = code
+            if (bits == 0):
+                continue  # repeat codes and such, nothing to tolerate.
+            key = (irtype, bits)
+            if (key not in self.tables):
+                self.tables[key] = (self._segments(bits),
+                                    [{} for _ in range(max_distance + 1)])
+            segments, buckets = self.tables[key]
+            for (shift, mask), bucket in zip(segments, buckets):
+                bucket.setdefault((value >> shift) & mask, []).append(
+                    (value, name))
+
+    def _segments(self, bits):
+        # splits the bits into max_distance + 1 (shift, mask) segments.
+        bits = min(bits, 32)
+        count = min(self.max_distance + 1, bits)
+        segments = []
+        start = 0
+        for i in range(count):
+            length = (bits - start) // (count - i)
+            segments.append((start, (1 << length) - 1))
+            start += length
+        return segments
+
+    def lookup(self, code):
+        """
+            Returns the name of the nearest known code, or None if there is no
+            code within the maximum distance or if the nearest is ambiguous.
+
+            :param code: The received code (type, bits, value).
+            :type code: tuple
+        """
+        irtype, bits, value = code
+        table = self.tables.get((irtype, bits))
+        if (table is None):
+            return None
+        segments, buckets = table
+        best = self.max_distance + 1
+        names = set()
+        for (shift, mask), bucket in zip(segments, buckets):
+            for candidate, name in bucket.get((value >> shift) & mask, ()):
+                distance = popcount(candidate ^ value)
+                if (distance < best):
+                    best = distance
+                    names = {name}
+                elif (distance == best):
+                    names.add(name)
+        if (not names):
+            return None
+        if (len(names) > 1):
+            self.ambiguous += 1
+            return None
+        self.matches += 1
+        return names.pop()
@@ -37,7 +37,13 @@ msg_type_t = namedtuple("msg_type", ["nop",
                                      "get_config",
                                      "get_status",
                                      "action_IR_send",
-                                     "action_IR_received"])
+                                     "action_IR_received",
+                                     "set_baudrate",
+                                     "set_protocol",
+                                     "action_raw_send",
+                                     "action_raw_received",
+                                     "raw_ack",
+                                     "action_IR_repeat"])
 # can do msg_type.nop or msg_type.get_config now.
 msg_type = msg_type_t(*range(0, len(msg_type_t._fields)))
 
@@ -48,6 +54,12 @@ msg_type_field = {
           msg_type_t._fields.index("action_IR_send"): "ir_specification",
           msg_type_t._fields.index("action_IR_received"): "ir_specification",
           msg_type_t._fields.index("get_status"): "status",
+          msg_type_t._fields.index("set_baudrate"): "baudrate",
+          msg_type_t._fields.index("set_protocol"): "protocol",
+          msg_type_t._fields.index("action_raw_send"): "raw_chunk",
+          msg_type_t._fields.index("action_raw_received"): "raw_chunk",
+          msg_type_t._fields.index("raw_ack"): "raw_chunk",
+          msg_type_t._fields.index("action_IR_repeat"): "ir_repeat",
         }
 
 # Reverse lookup for msg type, that is id->name
@@ -177,6 +189,32 @@ class MsgConfig(ctypes.LittleEndianStructure, Dictionary):
     _fields_ = [("serial_receive_timeout", ctypes.c_uint16)]
 
 
+class MsgBaudrate(ctypes.LittleEndianStructure, Dictionary):
+    _pack_ = 1
+    _fields_ = [("baudrate", ctypes.c_uint32)]
+
+
+class MsgProtocol(ctypes.LittleEndianStructure, Dictionary):
+    _pack_ = 1
+    _fields_ = [("version", ctypes.c_uint8)]
+
+
+# A chunk of raw timings, see raw.py for the encoding of the data.
+class MsgRawChunk(ctypes.LittleEndianStructure, Dictionary):
+    _pack_ = 1
+    _fields_ = [("sequence", ctypes.c_uint8),
+                ("flags", ctypes.c_uint8),
+                ("length", ctypes.c_uint8),
+                ("data", ctypes.c_uint8 * (PACKET_SIZE - 2 - 3))]
+
+    def __iter__(self):
+        for k, t in self._fields_:
+            if (k == "data"):
+                yield (k, list(self.data)[:self.length])
+            else:
+                yield (k, getattr(self, k))
+
+
 class MsgIRSpecification(ctypes.LittleEndianStructure, Dictionary):
     _pack_ = 1
     _fields_ = [("type", ctypes.c_uint8),
@@ -192,11 +230,36 @@ class MsgIRSpecification(ctypes.LittleEndianStructure, Dictionary):
                     self.bits, self.value)
 
 
+# A received IR code, stamped with the uptime of the MCU in milliseconds. The
+# first fields overlap with the IR specification.
+class MsgIRReceived(ctypes.LittleEndianStructure, Dictionary):
+    _pack_ = 1
+    _fields_ = [("type", ctypes.c_uint8),
+                ("bits", ctypes.c_uint8),
+                ("value", ctypes.c_uint32),
+                ("timestamp", ctypes.c_uint32)]
+
+
+# An IR code to be sent, followed by count repeats. Protocols with a repeat
+# frame, like NEC, send that instead of the entire code.
+class MsgIRRepeat(ctypes.LittleEndianStructure, Dictionary):
+    _pack_ = 1
+    _fields_ = [("type", ctypes.c_uint8),
+                ("bits", ctypes.c_uint8),
+                ("value", ctypes.c_uint32),
+                ("count", ctypes.c_uint8)]
+
+
 # create the composite message.
 class _MsgBody(ctypes.Union):
     _fields_ = [("config", MsgConfig),
                 ("status", MsgStatus),
                 ("ir_specification", MsgIRSpecification),
+                ("ir_received", MsgIRReceived),
+                ("ir_repeat", MsgIRRepeat),
+                ("baudrate", MsgBaudrate),
+                ("protocol", MsgProtocol),
+                ("raw_chunk", MsgRawChunk),
                 ("raw", ctypes.c_byte * (PACKET_SIZE-2))]
 
 #############################################################################
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Raw mark/space timings, for IR codes that can not be described by a
+    protocol, bit count and value. These are transferred in chunks with the
+    action_raw_send and action_raw_received messages.
+
+    Durations are expressed in ticks of RAW_TICK_US microseconds, the same
+    resolution as the receiver in the firmware uses. Each duration is encoded
+    in one byte if it is shorter than 128 ticks, otherwise in two bytes with
+    the highest bit of the first byte set. The stream of a sent code starts
+    with the carrier frequency in kHz.
+
+    The firmware buffers a sent code before sending it, so a code holds at
+    most MAX_DURATIONS (256) marks and spaces, and each of these is at most
+    MAX_TICKS ticks long. A 200 bit air conditioner frame, with about 400
+    durations, does not fit.
+
+    A PRONTO hex code can be converted with `parse_pronto`:
+        frequency, durations = parse_pronto("0000 006D 0022 0002 0155 00AA...")
+        interactor.send_raw(durations, frequency)
+"""
+
+from . import message
+
+import ctypes
+
+# resolution of the durations.
+RAW_TICK_US = 50
+
+# longest duration that can be sent, in ticks. The encoding allows 0x7FFF,
+# but the firmware hands the durations to sendRaw as 16 bit microseconds.
+MAX_TICKS = 0xFFFF // RAW_TICK_US
+
+# most durations in a sent code, this matches RAW_MAX_DURATIONS in the
+# firmware.
+MAX_DURATIONS = 256
+
+# flags of the chunks.
+RAW_FIRST = 0x01
+RAW_LAST = 0x02
+RAW_ERROR = 0x04  # set in a raw_ack if the chunk was out of sequence.
+
+CHUNK_SIZE = ctypes.sizeof(message.MsgRawChunk) - 3
+
+
+def parse_pronto(text):
+    """
+        Parses a learned PRONTO hex code (starting with 0000).
+
+        :param text: The hex words, separated by whitespace.
+        :type text: str
+        :returns: tuple of the carrier frequency in Hz and a list of
+            durations in microseconds, starting with a mark.
+        :raises ValueError: If the code is not a valid learned PRONTO code.
+    """
+    words = [int(w, 16) for w in text.split()]
+    if (len(words) < 4) or (words[0] != 0x0000) or (words[1] == 0):
+        raise ValueError("Not a learned PRONTO code.")
+    # the carrier is expressed in units of the 4.145146 MHz pronto clock.
+    frequency = 1000000.0 / (words[1] * 0.241246)
+    period = 1000000.0 / frequency
+    once, repeat = words[2], words[3]
+    pairs = words[4:]
+    if (len(pairs) != 2 * (once + repeat)):
+        raise ValueError("PRONTO length does not match its header.")
+    durations = [int(round(w * period)) for w in pairs]
+    return int(round(frequency)), durations
+
+
+def encode_durations(durations):
+    """
+        Encodes durations in microseconds into the compact byte format.
+    """
+    out = bytearray()
+    for us in durations:
+        ticks = min(MAX_TICKS, max(1, int(round(us / RAW_TICK_US))))
+        if (ticks < 0x80):
+            out.append(ticks)
+        else:
+            out.append(0x80 | (ticks >> 8))
+            out.append(ticks & 0xFF)
+    return bytes(out)
+
+
+def decode_durations(data):
+    """
+        Decodes the compact byte format into durations in microseconds.
+    """
+    durations = []
+    i = 0
+    while (i < len(data)):
+        b = data[i]
+        if (b & 0x80):
+            if (i + 1 >= len(data)):
+                raise ValueError("Truncated duration.")
+            durations.append((((b & 0x7F) << 8) | data[i + 1]) * RAW_TICK_US)
+            i += 2
+        else:
+            durations.append(b * RAW_TICK_US)
+            i += 1
+    return durations
+
+
+def airtime(durations):
+    """
+        Returns the time it takes to transmit the durations in seconds.
+    """
+    return sum(durations) / 1000000.0
+
+
+def chunk_messages(msg_type, data):
+    """
+        Splits an encoded stream into messages of the given type.
+
+        :returns: list of `message.Msg`
+    """
+    msgs = []
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data),
+                                                     CHUNK_SIZE)] or [b""]
+    for seq, chunk in enumerate(chunks):
+        msg = message.Msg()
+        msg.msg_type = msg_type
+        msg.raw_chunk.sequence = seq & 0xFF
+        msg.raw_chunk.flags = (RAW_FIRST if seq == 0 else 0) | (
+            RAW_LAST if seq == len(chunks) - 1 else 0)
+        msg.raw_chunk.length = len(chunk)
+        ctypes.memmove(msg.raw_chunk.data, bytes(chunk), len(chunk))
+        msgs.append(msg)
+    return msgs
+
+
+def send_messages(durations, frequency=38000):
+    """
+        Creates the action_raw_send messages for a raw code.
+
+        :param durations: Mark and space durations in microseconds.
+        :type durations: list of int
+        :param frequency: Carrier frequency in Hz.
+        :type frequency: int
+        :returns: list of `message.Msg`
+        :raises ValueError: If there are more than MAX_DURATIONS durations.
+    """
+    if (len(durations) > MAX_DURATIONS):
+        raise ValueError("{} durations, the firmware can send at most {}."
+                         "".format(len(durations), MAX_DURATIONS))
+    khz = min(255, max(1, int(round(frequency / 1000.0))))
+    return chunk_messages(message.msg_type.action_raw_send,
+                          bytes([khz]) + encode_durations(durations))
+
+
+class RawAssembler:
+    """
+        Reassembles the chunks of action_raw_received messages. Chunks out of
+        sequence discard the code that was being received, these are counted
+        in `errors`.
+    """
+    def __init__(self):
+        self.data = None
+        self.sequence = 0
+        self.errors = 0
+
+    def feed(self, msg):
+        """
+            Adds a chunk, returns the durations in microseconds once the code
+            is complete, None otherwise.
+        """
+        chunk = msg.raw_chunk
+        if (chunk.flags & RAW_FIRST):
+            self.data = bytearray()
+            self.sequence = chunk.sequence
+        elif (self.data is None) or (
+                chunk.sequence != (self.sequence + 1) & 0xFF):
+            self.data = None
+            self.errors += 1
+            return None
+        self.sequence = chunk.sequence
+        self.data += bytes(chunk.data)[:chunk.length]
+        if (chunk.flags & RAW_LAST):
+            data, self.data = bytes(self.data), None
+            try:
+                return decode_durations(data)
+            except ValueError:
+                self.errors += 1
+        return None
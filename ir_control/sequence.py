@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Recognizes sequences of received names, such as "menu, 1, 2", and binds
+    actions to these. The bindings are stored in a trie, every received name
+    advances one step in the trie, such that the work per keypress does not
+    depend on the number of bindings.
+
+    If a sequence is the prefix of another, for example "menu, 1" and
+    "menu, 1, 2", its action is performed when no further name arrives within
+    the timeout of that step. Names that do not complete a sequence are
+    passed on to be performed as normal actions.
+
+    The names of repeat codes, which are sent while a key is held, keep a
+    pending sequence alive. A binding like "red, up" thus also serves as
+    "hold red and press up".
+
+    Timeouts are handled by calling `poll` regularly, no threads or timers
+    are used.
+"""
+
+
+class _Node:
+    __slots__ = ("children", "action", "timeout")
+
+    def __init__(self):
+        self.children = {}
+        self.action = None
+        self.timeout = None
+
+
+class SequenceRecognizer:
+    """
+        :param timeout: The default time in seconds between the steps.
+        :type timeout: float
+        :param repeat_name: The name of the repeat code, if any.
+        :type repeat_name: str
+    """
+    def __init__(self, timeout=1.0, repeat_name=None):
+        self.root = _Node()
+        self.timeout = timeout
+        self.repeat_name = repeat_name
+        self.reset()
+
+    def reset(self):
+        self.node = self.root
+        self.names = []
+        self.deadline = None
+
+    def bind(self, names, action, timeout=None):
+        """
+            Binds an action to a sequence of names.
+
+            :param names: The sequence of names.
+            :type names: list of str
+            :param action: Called with (interactor, action_name), where
+                action_name is the names joined by a comma.
+            :type action: callable
+            :param timeout: Maximum time after each step of this sequence.
+            :type timeout: float
+        """
+        node = self.root
+        for name in names:
+            node = node.children.setdefault(name, _Node())
+            if (timeout is not None):
+                node.timeout = timeout
+        node.action = action
+
+    def is_prefix(self, name):
+        return name in self.root.children
+
+    def _abandon(self):
+        # returns what the pending names resolve to, and starts over.
+        if (self.node.action is not None):
+            result = [(self.node.action, self.names)]
+        else:
+            result = [(None, [name]) for name in self.names]
+        self.reset()
+        return result
+
+    def feed(self, name, now):
+        """
+            Processes a received name.
+
+            :returns: list of (action, names) tuples to be performed in order,
+                action is None if the single name should be performed as a
+                normal action.
+        """
+        result = self.poll(now)
+        if (self.names) and (name == self.repeat_name):
+            # a key is held, extend the current step.
+            self.deadline = now + self._timeout()
+            return result
+
+        child = self.node.children.get(name)
+        if (child is None) and (self.names):
+            # does not continue the pending sequence, resolve that first.
+            result += self._abandon()
+            child = self.node.children.get(name)
+        if (child is None):
+            result.append((None, [name]))
+            return result
+
+        self.node = child
+        self.names.append(name)
+        if (not child.children):
+            # a leaf, nothing can follow so it is performed immediately.
+            result += self._abandon()
+        else:
+            self.deadline = now + self._timeout()
+        return result
+
+    def _timeout(self):
+        return self.node.timeout if self.node.timeout is not None else \
+            self.timeout
+
+    def poll(self, now):
+        """
+            Resolves the pending sequence if its timeout expired.
+
+            :returns: list of (action, names) tuples, see `feed`.
+        """
+        if (self.deadline is not None) and (now >= self.deadline):
+            return self._abandon()
+        return []
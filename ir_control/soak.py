@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Ivor Wanders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    Soak test; runs the same objects as `start()` for a long time against a
+    simulated MCU and TCP clients, and checks that memory, threads and file
+    descriptors do not grow.
+
+    The simulated MCU is a thread on the master side of a pseudo terminal,
+    the `SerialInterface` opens the slave side like a real serial port. It
+    sends received IR codes at a fixed rate, replies to get_status and
+    consumes the codes to be sent. The TCP clients subscribe, request
+    statistics and send codes by name, reconnecting regularly.
+
+    At every interval the memory allocated by Python (with `tracemalloc`),
+    the resident set size, the number of threads and of open file descriptors
+    are printed. The first interval is the baseline, at the end the
+    allocation sites that grew the most are printed and the exit status is 1
+    if any growth exceeds its threshold:
+        python3 -m ir_control.soak --duration 14400 --rate 50
+"""
+
+from . import message
+from .actions import log, shell
+from .config import Configurator
+from .control import Interactor, ThreadedTCPServer, TCPCommandHandler
+from .heartbeat import Heartbeat
+from .interface import MessageQueue, SerialInterface
+
+import os
+import random
+import select
+import socket
+import threading
+import time
+import tracemalloc
+import tty
+
+# the codes sent by the simulated MCU, of which the last one is not known.
+_CODES = [message.IR(type=message.IR_type.NEC, bits=32, value=0x20DF0000 + i)
+          for i in range(8)]
+
+# the baudrates the firmware can switch to.
+BAUDRATES = (9600, 19200, 38400, 57600, 115200, 250000, 500000, 1000000)
+
+
+class SimulatedDevice(threading.Thread):
+    """
+        Behaves like the firmware, using version 1 of the protocol.
+
+        :param rate: Number of IR codes to send per second, 0 for none.
+        :type rate: float
+    """
+    def __init__(self, rate):
+        super().__init__()
+        self.daemon = True
+        self.rate = rate
+        self.running = True
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.started = time.monotonic()
+        self.received = 0  # codes requested to be sent.
+        self.sent = 0  # codes sent as received.
+        self.baudrate = 9600
+
+    def _write(self, msg):
+        os.write(self.master, bytes(msg))
+
+    def _handle(self, msg):
+        if (msg.msg_type == msg.type.get_status):
+            reply = message.Msg()
+            reply.msg_type = reply.type.get_status
+            reply.status.uptime = int((time.monotonic() - self.started) *
+                                      1000)
+            self._write(reply)
+        elif (msg.msg_type == msg.type.set_baudrate):
+            # a pseudo terminal has no speed, acknowledge like the firmware.
+            if (msg.baudrate.baudrate not in BAUDRATES):
+                msg.baudrate.baudrate = self.baudrate
+            self.baudrate = msg.baudrate.baudrate
+            self._write(msg)
+        elif (msg.msg_type in (msg.type.action_IR_send,
+                               msg.type.action_IR_repeat)):
+            self.received += 1
+
+    def run(self):
+        buffer = b""
+        next_at = time.monotonic()
+        while (self.running):
+            timeout = max(0, next_at - time.monotonic()) if self.rate else 0.1
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if (readable):
+                buffer += os.read(self.master, 1024)
+                while (len(buffer) >= message.PACKET_SIZE):
+                    self._handle(message.Msg.read(
+                        buffer[:message.PACKET_SIZE]))
+                    buffer = buffer[message.PACKET_SIZE:]
+            if (self.rate) and (time.monotonic() >= next_at):
+                next_at += 1.0 / self.rate
+                msg = message.Msg()
+                msg.msg_type = msg.type.action_IR_received
+                msg.ir_specification.from_dict(random.choice(_CODES).raw())
+                self._write(msg)
+                self.sent += 1
+
+    def stop(self):
+        self.running = False
+        self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class Clients(threading.Thread):
+    """
+        TCP clients; subscribers that reconnect every `lifetime` seconds, and
+        a client that requests statistics and sends codes by name.
+    """
+    def __init__(self, address, subscribers=4, commands=5.0, lifetime=30.0):
+        super().__init__()
+        self.daemon = True
+        self.address = address
+        self.subscribers = subscribers
+        self.commands = commands
+        self.lifetime = lifetime
+        self.running = True
+        self.events = 0
+        self.errors = 0
+
+    def _subscriber(self):
+        while (self.running):
+            try:
+                with socket.create_connection(self.address) as sock:
+                    sock.sendall(b"subscribe soak_")
+                    sock.settimeout(0.5)
+                    until = time.monotonic() + self.lifetime * (
+                        0.5 + random.random())
+                    while (self.running) and (time.monotonic() < until):
+                        try:
+                            self.events += sock.recv(4096).count(b"\n")
+                        except socket.timeout:
+                            pass
+            except OSError:
+                self.errors += 1
+                time.sleep(0.1)
+
+    def _command(self, data):
+        try:
+            with socket.create_connection(self.address) as sock:
+                sock.sendall(data)
+                if (data == b"stats"):
+                    sock.settimeout(1.0)
+                    sock.recv(4096)
+        except OSError:
+            self.errors += 1
+
+    def run(self):
+        threads = [threading.Thread(target=self._subscriber, daemon=True)
+                   for i in range(self.subscribers)]
+        for thread in threads:
+            thread.start()
+        while (self.running):
+            time.sleep(1.0 / self.commands)
+            self._command(random.choice([b"stats", b"soak_0", b"soak_1"]))
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+def rss():
+    """
+        Returns the resident set size in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def open_fds():
+    """
+        Returns the number of open file descriptors.
+    """
+    for path in ("/proc/self/fd", "/dev/fd"):
+        if (os.path.isdir(path)):
+            return len(os.listdir(path))
+    return 0
+
+
+class Sample:
+    def __init__(self):
+        self.time = time.monotonic()
+        self.snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)])
+        self.traced = tracemalloc.get_traced_memory()[0]
+        self.rss = rss()
+        self.threads = threading.active_count()
+        self.fds = open_fds()
+
+
+def configuration(shell_fraction):
+    """
+        Returns a configuration for the codes of the simulated MCU, with the
+        actions that `start()` users typically have.
+    """
+    conf = Configurator()
+    for i, code in enumerate(_CODES[:-1]):
+        conf.add_code("soak_{}".format(i), code)
+        conf.action("soak_{}".format(i), log("soak", level=5))
+    if (shell_fraction):
+        conf.action("soak_0", shell("true"))
+    conf.set_repeat_name("soak_6")
+    return conf
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Soak test against a "
+                                     "simulated MCU and TCP clients.")
+    parser.add_argument("--duration", default=3600.0, type=float,
+                        help="Seconds to run.")
+    parser.add_argument("--interval", default=60.0, type=float,
+                        help="Seconds between samples.")
+    parser.add_argument("--rate", default=50.0, type=float,
+                        help="IR codes received per second.")
+    parser.add_argument("--subscribers", default=4, type=int,
+                        help="Number of TCP subscribers.")
+    parser.add_argument("--commands", default=5.0, type=float,
+                        help="TCP commands per second.")
+    parser.add_argument("--shell", default=False, action="store_true",
+                        help="Run a shell action for one of the codes.")
+    parser.add_argument("--max-rss", default=8.0, type=float,
+                        help="Maximum growth of the RSS in MB.")
+    parser.add_argument("--max-traced", default=2.0, type=float,
+                        help="Maximum growth of the Python allocations in "
+                        "MB.")
+    parser.add_argument("--max-threads", default=2, type=int,
+                        help="Maximum growth of the number of threads.")
+    parser.add_argument("--max-fds", default=4, type=int,
+                        help="Maximum growth of open file descriptors.")
+    args = parser.parse_args()
+
+    tracemalloc.start(8)
+
+    device = SimulatedDevice(args.rate)
+    device.start()
+
+    # the same objects as start() creates.
+    interface = SerialInterface(
+        packet_size=message.PACKET_SIZE,
+        rx_queue=MessageQueue(256, "drop_oldest"),
+        tx_queue=MessageQueue(256, "drop_newest"))
+    interface.connect(serial_port=device.path, baudrate=115200)
+    interface.start()
+    m = Interactor(interface, serial_port=device.path, baudrate=115200)
+    m.load_config(configuration(args.shell))
+    m.heartbeat = Heartbeat(1.0)
+    server = ThreadedTCPServer(("127.0.0.1", 0), TCPCommandHandler)
+    server.setManager(m)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    loop = threading.Thread(target=m.loop, daemon=True)
+    loop.start()
+    clients = Clients(server.server_address, args.subscribers, args.commands)
+    clients.start()
+
+    print("   time      rss   traced  threads  fds  received  events")
+    baseline = None
+    last = None
+    end = time.monotonic() + args.duration
+    while (time.monotonic() < end):
+        time.sleep(min(args.interval, max(0, end - time.monotonic())))
+        last = Sample()
+        if (baseline is None):
+            baseline = last  # after warming up.
+        print("{:7.0f} {:7.2f}M {:7.2f}M {:8d} {:4d} {:9d} {:7d}".format(
+              last.time - baseline.time, last.rss / 2**20,
+              last.traced / 2**20, last.threads, last.fds, device.sent,
+              clients.events))
+        sys.stdout.flush()
+
+    clients.stop()
+    server.serving = False
+    server.shutdown()
+    server.server_close()
+    m.stop()
+    loop.join()
+    interface.stop()
+    device.stop()
+
+    if (baseline is None) or (last is baseline):
+        print("Too short to compare, increase the duration.")
+        return 1
+
+    print("\nAllocation sites that grew the most:")
+    for stat in last.snapshot.compare_to(baseline.snapshot,
+                                         "lineno")[:10]:
+        print(stat)
+
+    growth = [("RSS", (last.rss - baseline.rss) / 2**20, args.max_rss),
+              ("Traced memory", (last.traced - baseline.traced) / 2**20,
+               args.max_traced),
+              ("Threads", last.threads - baseline.threads, args.max_threads),
+              ("File descriptors", last.fds - baseline.fds, args.max_fds)]
+    failed = False
+    for name, value, limit in growth:
+        if (value > limit):
+            print("{} grew by {:.2f}, more than {}.".format(name, value,
+                                                            limit))
+            failed = True
+    print("Received {}, sent {}, {} events to subscribers, {} client errors, "
+          "statistics: {}".format(device.sent, device.received,
+                                  clients.events, clients.errors,
+                                  m.get_statistics()))
+    print("FAILED" if failed else "PASSED")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())